@@ -2,13 +2,12 @@ import streamlit as st
 import os
 from typing import Dict, List, Set
 import numpy as np
+import pandas as pd
 from collections import defaultdict
 
-from data_loader import load_products
-from text_clean import normalize_text
-from shingling import char_k_shingles
-from minhash_lsh import MinHasher, LSH, jaccard_from_sigs
+import instrument
 from metrics import precision_at_k
+from engine import SimilarityEngine
 
 st.set_page_config(page_title="Amazon Similar Products (LSH)", layout="wide")
 
@@ -19,31 +18,43 @@ if not os.path.exists(data_path):
     st.warning("Please place the dataset at data/meta_Appliances.json or data/meta_Appliances.json.gz (or update the path above).")
     st.stop()
 
+@st.cache_resource
+def get_engine(store_dir: str) -> SimilarityEngine:
+    # one engine per store survives reruns; its stages memoize shingles, signatures and bands
+    return SimilarityEngine(store_dir)
+
+engine = get_engine(os.path.join(os.path.dirname(data_path), "index_store"))
+
+# instrumentation is process-wide and survives reruns; the panel at the bottom shows it
+if st.sidebar.checkbox("Record pipeline instrumentation", value=instrument.is_enabled()):
+    instrument.enable()
+else:
+    instrument.disable()
 
 with st.spinner("Loading products..."):
-    products = load_products(data_path)
+    products = engine.load(data_path)
 
 st.success(f"Loaded {len(products)} products.")
 
 # Exercise 1: Simple listing
 st.header("Exercise 1: Product Listing")
 search = st.text_input("Filter by substring (title)", value="")
-max_rows = st.slider("Max products to show", 10, 500, 50, 10)
+max_rows = st.slider("Products per page", 10, 500, 50, 10)
+page = st.number_input("Page", min_value=1, value=1, step=1)
 
 def product_card(p):
     st.markdown(f"**{p['asin']}** — {p['title']}")
     if p['description']:
         st.caption((p['description'][:240] + '...') if len(p['description'])>240 else p['description'])
 
-count = 0
-for asin, p in products.items():
-    if search and search.lower() not in p['title'].lower():
-        continue
+page_asins, more = engine.search_titles(search, offset=(page - 1) * max_rows, limit=max_rows)
+for asin in page_asins:
     with st.container():
-        product_card(p)
-    count += 1
-    if count >= max_rows:
-        break
+        product_card(products[asin])
+if not page_asins:
+    st.caption("No matching products on this page.")
+elif more:
+    st.caption(f"More matches on page {page + 1}.")
 
 st.divider()
 st.header("Exercise 2: Similar Products with PST / PSD / PSTD")
@@ -54,56 +65,39 @@ num_hashes = st.select_slider("# of MinHash functions", options=[10,20,50,100,15
 b = st.number_input("LSH bands (b)", min_value=1, value=20, step=1)
 r = st.number_input("LSH rows per band (r) — must satisfy b*r = #hashes", min_value=1, value=5, step=1)
 top_k = st.select_slider("Top-k to show", options=[5,10,20], value=10)
+rerank = st.checkbox("Rerank top candidates by exact Jaccard", value=False)
+max_bucket = st.number_input("Max LSH bucket size (0 = no cap; larger buckets are sampled)", min_value=0, value=0, step=100)
+bits = st.selectbox("Signature bits used for scoring (0 = full width)", options=[0, 1, 2, 4, 8, 16], index=0)
+title_weight = 0.0
+if sim_mode.startswith("PSTD"):
+    title_weight = st.slider("Title weight (0 = Jaccard of title + description shingles)", 0.0, 1.0, 0.0, 0.05)
+
+with st.expander("Suggest b, r for a target similarity"):
+    tune_s = st.slider("Target similarity", 0.1, 0.95, 0.5, 0.05)
+    tune_recall = st.slider("Recall goal at target", 0.5, 0.99, 0.9, 0.01)
+    if st.button("Suggest"):
+        with st.spinner("Sampling similarities..."):
+            best = engine.suggest_bands(sim_mode.split()[0], K, tune_s, tune_recall)
+        st.info(f"#hashes={best['num_hashes']}, b={best['b']}, r={best['r']} — predicted recall "
+                f"{best['recall_at_threshold']:.3f}, ~{best['pred_candidates']:.0f} candidates/query, "
+                f"{best['pred_index_mb']:.1f} MB index")
 
 if b*r != num_hashes:
-    st.error("Constraint violated: b * r must equal #hashes.")
+    st.error("Constraint violated: b * r must equal #hashes (use the suggestion above to pick a valid pair).")
     st.stop()
 
 # Pick a product that has similar_item entries
-candidates = [p for p in products.values() if p.get('similar_item')]
-default_asin = candidates[0]['asin'] if candidates else next(iter(products.keys()))
+default_asin = next((asin for asin, p in products.items() if p.get('similar_item')), next(iter(products.keys())))
 asin_choice = st.text_input("Query ASIN", value=default_asin)
 
 if asin_choice not in products:
     st.error("ASIN not found in loaded data.")
     st.stop()
 
-# Build representations
-def build_text(p, mode:str) -> str:
-    if mode.startswith("PST "):
-        return p['norm_title']
-    elif mode.startswith("PSD "):
-        return p['norm_desc']
-    else:
-        # hybrid: upweight title slightly by repeating once
-        return (p['norm_title'] + " " + p['norm_title'] + " " + p['norm_desc']).strip()
-
-def build_all_shingles(mode: str) -> Dict[str, set]:
-    out = {}
-    for asin, p in products.items():
-        text = build_text(p, mode)
-        out[asin] = char_k_shingles(text, K)
-    return out
-
 with st.spinner("Building shingles and MinHash signatures..."):
-    shingle_map = build_all_shingles(sim_mode)
-    mh = MinHasher(num_hashes)
-    signatures = {asin: mh.signature(shs) for asin, shs in shingle_map.items()}
-    lsh = LSH(bands=b, rows=r)
-    index = lsh.index(signatures)
-
-query_sig = signatures[asin_choice]
-cand_ids = lsh.query_candidates(query_sig, index)
-cand_ids.discard(asin_choice)
-
-# Score candidates by MinHash-Jaccard
-scores = []
-for cid in cand_ids:
-    sim = jaccard_from_sigs(query_sig, signatures[cid])
-    scores.append((cid, sim))
-scores.sort(key=lambda x: x[1], reverse=True)
-
-top = scores[:top_k]
+    top = engine.query(asin_choice, sim_mode.split()[0], K, num_hashes, b, r, top_k,
+                       rerank_depth=5 * top_k if rerank else 0, max_bucket=max_bucket, bits=bits,
+                       title_weight=title_weight)
 
 st.subheader("Query Product")
 qp = products[asin_choice]
@@ -121,3 +115,19 @@ truth = set(qp.get('similar_item', []))
 if truth:
     prec = precision_at_k([cid for cid,_ in top], truth, k=top_k)
     st.info(f"precision@{top_k} vs given similar_item set: **{prec:.3f}** (|truth|={len(truth)})")
+
+if instrument.is_enabled():
+    with st.expander("Pipeline instrumentation", expanded=False):
+        snap = instrument.snapshot()
+        if st.button("Reset counters"):
+            instrument.reset()
+            snap = instrument.snapshot()
+        if snap["timers"]:
+            st.markdown("**Stage timings**")
+            st.dataframe(pd.DataFrame.from_dict(snap["timers"], orient="index").sort_values("total_s", ascending=False))
+        if snap["counters"]:
+            st.markdown("**Counters**")
+            st.dataframe(pd.Series(snap["counters"], name="value"))
+        for name, h in snap["histograms"].items():
+            st.markdown(f"**{name}** — n={h['count']}, mean={h['mean']:.1f}, p99 ≤ {h['p99']:.0f}, max={h['max']:.0f}")
+            st.bar_chart(pd.Series(h["buckets"], name="count"))
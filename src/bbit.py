@@ -0,0 +1,98 @@
+from typing import Union
+
+import numpy as np
+
+BIT_WIDTHS = (1, 2, 4, 8, 16)
+
+_BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    """Set bits per uint64 word (np.bitwise_count on numpy >= 2, byte table otherwise)."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    return _BYTE_POPCOUNT[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1)
+
+
+def _field_mask(bits: int) -> np.uint64:
+    """uint64 with the lowest bit of every `bits`-wide field set, e.g. 0x5555... for bits=2."""
+    return np.uint64(sum(1 << i for i in range(0, 64, bits)))
+
+
+def pack_bbit(sig_matrix: np.ndarray, bits: int) -> np.ndarray:
+    """Lowest `bits` bits of every signature entry, packed 64 // bits per uint64 word.
+
+    Returns shape (n_items, ceil(num_hashes * bits / 64)); unused fields of the last
+    word are zero.
+    """
+    if bits not in BIT_WIDTHS:
+        raise ValueError(f"bits must be one of {BIT_WIDTHS}")
+    sig_matrix = np.atleast_2d(np.asarray(sig_matrix))
+    n, H = sig_matrix.shape
+    per_word = 64 // bits
+    n_words = -(-H // per_word)
+    low = np.zeros((n, n_words * per_word), dtype=np.uint64)
+    low[:, :H] = sig_matrix.astype(np.uint64) & np.uint64((1 << bits) - 1)
+    shifts = (np.arange(per_word, dtype=np.uint64) * np.uint64(bits))
+    return np.bitwise_or.reduce(low.reshape(n, n_words, per_word) << shifts, axis=2)
+
+
+def bbit_matches(query_words: np.ndarray, words: np.ndarray, bits: int, num_hashes: int) -> np.ndarray:
+    """Number of equal b-bit fields between the query and every row of `words`.
+
+    XOR the words, fold each field onto its lowest bit, then popcount the mismatches.
+    Padding fields are zero on both sides, so they never count as mismatches.
+    """
+    diff = np.bitwise_xor(words, query_words)
+    shift = 1
+    while shift < bits:
+        diff = diff | (diff >> np.uint64(shift))
+        shift *= 2
+    if bits > 1:
+        diff = diff & _field_mask(bits)
+    mismatches = _popcount(diff).sum(axis=-1, dtype=np.int64)
+    return num_hashes - mismatches
+
+
+def bbit_similarity(matches: Union[np.ndarray, int], bits: int, num_hashes: int) -> np.ndarray:
+    """Jaccard estimate from b-bit matches, corrected for accidental collisions.
+
+    Two different minimum hashes still agree on their lowest b bits with
+    probability 2^-b, so P(match) = C + (1 - C) * J with C = 2^-b (sparse-set
+    approximation of Li & König). Solving for J and clipping to [0, 1].
+    """
+    c = 1.0 / (1 << bits)
+    raw = np.asarray(matches, dtype=np.float64) / num_hashes
+    return np.clip((raw - c) / (1.0 - c), 0.0, 1.0)
+
+
+class PackedSignatures:
+    """b-bit packed signature matrix that scoring can use in place of the full int64 one.
+
+    Row indexing returns the packed words of an item, so `score_candidates` works
+    unchanged; band keys must still be built from the full-width signatures.
+    """
+
+    def __init__(self, words: np.ndarray, bits: int, num_hashes: int):
+        self.words = words
+        self.bits = bits
+        self.num_hashes = num_hashes
+
+    @classmethod
+    def from_signatures(cls, sig_matrix: np.ndarray, bits: int) -> "PackedSignatures":
+        return cls(pack_bbit(sig_matrix, bits), bits, sig_matrix.shape[1])
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __getitem__(self, rows) -> np.ndarray:
+        return self.words[rows]
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.words.nbytes)
+
+    def scores(self, query_words: np.ndarray, cand_ids: np.ndarray) -> np.ndarray:
+        """Bias-corrected Jaccard estimates of the query against the candidate rows."""
+        matches = bbit_matches(query_words, self.words[cand_ids], self.bits, self.num_hashes)
+        return bbit_similarity(matches, self.bits, self.num_hashes)
@@ -0,0 +1,247 @@
+import argparse
+import gzip
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from data_loader import load_products, read_json_lines
+from text_clean import build_text
+from metrics import map_at_k
+from minhash_lsh import HASH_VERSION, LSH, ArrayLSH, MinHasher
+from scoring import score_candidates
+from shingling import char_k_shingles
+from text_clean import normalize_text
+
+_NOUNS = ("refrigerator water filter dryer vent hose washer drive belt ice maker dishwasher rack range hood "
+          "burner grate oven igniter thermostat defrost timer door gasket drain pump motor coupling lint screen "
+          "heating element knob bracket kit cord receptacle valve compressor fan blade shelf bin").split()
+_WORDS = ("replacement compatible genuine oem part fits models stainless steel white black universal heavy duty "
+          "easy install high quality durable pack of premium exact fit whirlpool ge frigidaire samsung lg kenmore "
+          "maytag bosch amana for with and the").split()
+
+
+def _model(rng: random.Random) -> str:
+    return rng.choice("WDEPRX") + str(rng.randrange(10**5, 10**8))
+
+
+def _text(rng: random.Random, n_words: int) -> str:
+    return " ".join(rng.choices(_NOUNS, k=max(1, n_words // 3)) + rng.choices(_WORDS, k=n_words - n_words // 3))
+
+
+def _mutate(rng: random.Random, text: str, edits: int) -> str:
+    words = text.split()
+    for _ in range(edits):
+        words[rng.randrange(len(words))] = rng.choice(_WORDS)
+    return " ".join(words)
+
+
+def _similar_html(asins: List[str]) -> str:
+    cells = "".join(f'<th class="comparison_image_title_cell"><a class="a-link-normal" '
+                    f'href="/dp/{a}/ref=psdc_t{i}_{a}"><span>item</span></a></th>' for i, a in enumerate(asins))
+    return f'<tr class="comparison_table_image_row">{cells}</tr>'
+
+
+def generate_catalog(path: str, n: int, title_words: int = 10, desc_words: int = 60, dup_rate: float = 0.1,
+                     seed: int = 0) -> str:
+    """Write `n` Appliances-style JSON-lines records (gzip if `path` ends in .gz).
+
+    Titles and descriptions average `title_words` / `desc_words` words (±50%); a
+    `dup_rate` fraction of products are lightly edited copies of an earlier product,
+    and both sides of every such pair list each other in similar_item, so the
+    catalog has a known ground truth.
+    """
+    rng = random.Random(seed)
+    asins = [f"B{i:09d}" for i in range(n)]
+    parent = [i if i == 0 or rng.random() >= dup_rate else rng.randrange(i) for i in range(n)]
+    links: Dict[int, List[int]] = {}
+    for i, p in enumerate(parent):
+        if p != i:
+            links.setdefault(i, []).append(p)
+            links.setdefault(p, []).append(i)
+    titles: List[str] = []
+    descs: List[str] = []
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wt", encoding="utf-8") as f:
+        for i in range(n):
+            if parent[i] != i:
+                titles.append(_mutate(rng, titles[parent[i]], 1))
+                descs.append(_mutate(rng, descs[parent[i]], 3))
+            else:
+                titles.append(f"{_text(rng, rng.randint(title_words // 2, title_words * 3 // 2))} {_model(rng)}")
+                descs.append(_text(rng, rng.randint(desc_words // 2, desc_words * 3 // 2)))
+            rec = {"asin": asins[i], "title": titles[i], "description": [f"<p>{descs[i]}</p>"],
+                   "also_buy": [asins[rng.randrange(n)] for _ in range(rng.randint(0, 3))]}
+            if i in links:
+                rec["similar_item"] = _similar_html([asins[j] for j in links[i]])
+            f.write(json.dumps(rec) + "\n")
+    return path
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def _stage(results: Dict[str, Dict[str, float]], name: str, items: int, fn: Callable[[], Any],
+           trace_memory: bool = False) -> Any:
+    """Run fn() once, recording wall time, process peak RSS and (optionally) its own allocation peak."""
+    if trace_memory:
+        tracemalloc.start()
+    t = time.perf_counter()
+    out = fn()
+    seconds = time.perf_counter() - t
+    rec = {"seconds": seconds, "items": items, "us_per_item": 1e6 * seconds / max(items, 1),
+           "rss_peak_mb": _peak_rss_mb()}
+    if trace_memory:
+        rec["alloc_peak_mb"] = tracemalloc.get_traced_memory()[1] / (1 << 20)
+        tracemalloc.stop()
+    results[name] = rec
+    return out
+
+
+def run_benchmark(path: str, K: int = 5, num_hashes: int = 100, b: int = 20, r: int = 5, top_k: int = 10,
+                  n_queries: int = 1000, sample: int = 2000, trace_memory: bool = False) -> Dict[str, Dict[str, float]]:
+    """Time every pipeline stage on one catalog file; returns {stage: measurements}."""
+    res: Dict[str, Dict[str, float]] = {}
+    n = _stage(res, "read_json_lines", 1, lambda: sum(1 for _ in read_json_lines(path)), trace_memory)
+    rec = res["read_json_lines"]
+    rec["items"], rec["us_per_item"] = n, 1e6 * rec["seconds"] / max(n, 1)
+    products = _stage(res, "load_products", n, lambda: load_products(path, use_cache=False), trace_memory)
+    asins = list(products)
+    raw = [(p["title"], p["description"]) for p in products.values()]
+    _stage(res, "normalize_text", 2 * n, lambda: [(normalize_text(t), normalize_text(d)) for t, d in raw],
+           trace_memory)
+    texts = [build_text(products[a], "PSTD") for a in asins]
+    sample_texts = texts[:sample]
+    _stage(res, "char_k_shingles", len(sample_texts), lambda: [char_k_shingles(t, K) for t in sample_texts],
+           trace_memory)
+    mh = MinHasher(num_hashes)
+    shingle_sets = [char_k_shingles(t, K) for t in sample_texts]
+    _stage(res, "MinHasher.signature", len(shingle_sets), lambda: [mh.signature(s) for s in shingle_sets],
+           trace_memory)
+    values, offsets = _stage(res, "MinHasher.hash_texts", n, lambda: mh.hash_texts(texts, K), trace_memory)
+    sigs = _stage(res, "MinHasher.signature_matrix", n, lambda: mh.signature_matrix(values, offsets), trace_memory)
+
+    lsh = LSH(b, r)
+    sig_dict = dict(zip(asins, sigs))
+    buckets = _stage(res, "LSH.index", n, lambda: lsh.index(sig_dict), trace_memory)
+    alsh = _stage(res, "ArrayLSH.index", n, lambda: ArrayLSH(b, r).index(sigs), trace_memory)
+
+    query_rows = [i for i, a in enumerate(asins) if products[a]["similar_item"]][:n_queries]
+    nq = len(query_rows)
+    _stage(res, "LSH.query_candidates", nq,
+           lambda: [lsh.query_candidates(sigs[q], buckets) for q in query_rows], trace_memory)
+    cand_offsets, cand_ids = _stage(res, "ArrayLSH.query_many", nq,
+                                    lambda: alsh.query_many(sigs[np.array(query_rows, dtype=np.int64)]), trace_memory)
+
+    def score_all() -> Dict[str, List[str]]:
+        preds = {}
+        for i, q in enumerate(query_rows):
+            ids, _ = score_candidates(q, cand_ids[cand_offsets[i]:cand_offsets[i+1]], sigs, top_k)
+            preds[asins[q]] = [asins[c] for c in ids]
+        return preds
+    preds = _stage(res, "score_candidates", nq, score_all, trace_memory)
+    truth = {asins[q]: set(products[asins[q]]["similar_item"]) for q in query_rows}
+    score = _stage(res, "map_at_k", nq, lambda: map_at_k(preds, truth, top_k), trace_memory)
+    res["map_at_k"]["value"] = score
+    return res
+
+
+def compare_to_baseline(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.2) -> List[str]:
+    """Human-readable regressions: stages whose time or peak memory grew by more than `tolerance`.
+
+    Timings are only compared when neither run traced allocations (tracemalloc slows every stage).
+    """
+    traced = any(run.get("meta", {}).get("params", {}).get("trace_memory") for run in (current, baseline))
+    metrics = ("alloc_peak_mb",) if traced else ("seconds", "alloc_peak_mb")
+    problems = []
+    for size, stages in current["results"].items():
+        base_stages = baseline.get("results", {}).get(size, {})
+        for stage, rec in stages.items():
+            base = base_stages.get(stage)
+            if base is None:
+                continue
+            for metric in metrics:
+                if metric in rec and metric in base and base[metric] > 0:
+                    ratio = rec[metric] / base[metric]
+                    # ignore sub-millisecond stages, they are dominated by noise
+                    if ratio > 1 + tolerance and (metric != "seconds" or rec[metric] > 1e-3):
+                        problems.append(f"n={size} {stage} {metric}: {base[metric]:.4g} -> {rec[metric]:.4g} "
+                                        f"({ratio:.2f}x)")
+    return problems
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pipeline benchmark on synthetic catalogs")
+    ap.add_argument("--sizes", nargs="+", type=int, default=[10000, 100000, 1000000])
+    ap.add_argument("--title_words", type=int, default=10)
+    ap.add_argument("--desc_words", type=int, default=60)
+    ap.add_argument("--dup_rate", type=float, default=0.1, help="fraction of products that are near-duplicates")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--work_dir", default="bench_data", help="generated catalogs are cached here")
+    ap.add_argument("--K", type=int, default=5)
+    ap.add_argument("--num_hashes", type=int, default=100)
+    ap.add_argument("--b", type=int, default=20)
+    ap.add_argument("--r", type=int, default=5)
+    ap.add_argument("--queries", type=int, default=1000, help="query products per catalog")
+    ap.add_argument("--sample", type=int, default=2000, help="products for the per-item string-path stages")
+    ap.add_argument("--trace_memory", action="store_true",
+                    help="also record each stage's own allocation peak (tracemalloc; slows the run)")
+    ap.add_argument("--out", default="reports/bench.json", help="where to write this run's results")
+    ap.add_argument("--baseline", default=None, help="earlier bench JSON to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before flagging (0.2 = 20%%)")
+    args = ap.parse_args()
+
+    baseline = None
+    if args.baseline:
+        # read it before any results are written: --out may not overwrite the run it is compared with
+        if os.path.exists(args.out) and os.path.samefile(args.out, args.baseline):
+            ap.error("--out and --baseline must be different files")
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    run = {"meta": {"python": platform.python_version(), "numpy": np.__version__, "hash_version": HASH_VERSION,
+                    "machine": platform.machine(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "params": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "work_dir")}},
+           "results": {}}
+    for n in args.sizes:
+        path = os.path.join(args.work_dir, f"catalog_n{n}_t{args.title_words}_d{args.desc_words}"
+                                           f"_dup{args.dup_rate}_s{args.seed}.json.gz")
+        if not os.path.exists(path):
+            print(f"generating {path}")
+            generate_catalog(path + ".tmp.gz", n, args.title_words, args.desc_words, args.dup_rate, args.seed)
+            os.replace(path + ".tmp.gz", path)
+        res = run_benchmark(path, args.K, args.num_hashes, args.b, args.r, n_queries=args.queries,
+                            sample=args.sample, trace_memory=args.trace_memory)
+        run["results"][str(n)] = res
+        print(f"n={n}")
+        for stage, rec in res.items():
+            print(f"  {stage:28s} {rec['seconds']:9.3f}s {rec['us_per_item']:10.1f} us/item "
+                  f"{rec['rss_peak_mb']:8.0f} MB rss")
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(run, f, indent=2)
+    print("Saved results to", args.out)
+
+    if baseline is not None:
+        problems = compare_to_baseline(run, baseline, args.tolerance)
+        for p in problems:
+            print("REGRESSION", p)
+        if problems:
+            sys.exit(1)
+        print("No regressions against", args.baseline)
+
+
+if __name__ == "__main__":
+    main()
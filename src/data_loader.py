@@ -1,85 +1,178 @@
 import gzip
 import json
-from typing import Dict, Any
-from bs4 import BeautifulSoup
+import re
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional
 
+import instrument
 from text_clean import normalize_text
+from product_cache import LazyProducts, open_product_cache, write_product_cache
 
-def read_json_lines(path: str):
-    """Reads either JSON array or line-delimited JSON (.json or .json.gz)."""
+# Related ASINs in similar_item HTML come from hrefs like "/dp/B000FPDO4Y/ref=..."
+DP_HREF_RE = re.compile(r"""href\s*=\s*["'][^"']*?/dp/([^/"']+)""")
+
+def _open_text(path: str):
     if path.endswith(".gz"):
-        opener = gzip.open
-        mode = "rt"
-    else:
-        opener = open
-        mode = "r"
-
-    with opener(path, mode, encoding="utf-8") as f:
-        first_char = f.read(1)
-        f.seek(0)
-
-        # Case 1: JSON array
-        if first_char == "[":
-            data = json.load(f)
-            for obj in data:
-                yield obj
-        # Case 2: JSON lines
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+def _refill(f, buf: str, pos: int, chunk_size: int):
+    more = f.read(chunk_size)
+    return buf[pos:] + more, 0, not more
+
+def _iter_json_array(f, head: str, chunk_size: int) -> Iterator[Any]:
+    """Incrementally decode the elements of a top-level JSON array."""
+    decoder = json.JSONDecoder()
+    buf = head.lstrip("\ufeff \t\r\n")
+    pos = 1  # past the opening "["
+    eof = False
+    while True:
+        # skip whitespace and element separators, pulling more text if needed
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf, pos, eof = _refill(f, buf, pos, chunk_size)
+        if pos >= len(buf) or buf[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            buf, pos, eof = _refill(f, buf, pos, chunk_size)
+            continue
+        # a value ending exactly at the buffer edge may have been cut short
+        if end == len(buf) and not eof:
+            buf, pos, eof = _refill(f, buf, pos, chunk_size)
+            continue
+        yield obj
+        pos = end
+
+def read_json_lines(path: str, chunk_size: int = 1 << 20):
+    """Streams records from either a JSON array or line-delimited JSON (.json or .json.gz)."""
+    for batch in _iter_raw_batches(path, 1, chunk_size):
+        for item in batch:
+            yield json.loads(item) if isinstance(item, str) else item
+
+def _iter_raw_batches(path: str, batch_size: int, chunk_size: int = 1 << 20) -> Iterator[List[Any]]:
+    # JSON lines are batched as raw strings so decoding happens in the workers;
+    # JSON arrays have to be decoded here to find element boundaries.
+    with _open_text(path) as f:
+        head = f.read(chunk_size)
+        if head.lstrip("\ufeff \t\r\n").startswith("["):
+            items = _iter_json_array(f, head, chunk_size)
         else:
-            for line in f:
-                if line.strip():
-                    yield json.loads(line)
+            items = (line for line in _iter_lines(f, head) if line.strip())
+        batch: List[Any] = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def _iter_lines(f, head: str) -> Iterator[str]:
+    # finish the partially read line, then continue line by line
+    lines = (head + f.readline()).split("\n")
+    yield from lines
+    yield from f
+
+def extract_related_asins(similar_html: Any) -> List[str]:
+    """ASINs linked via /dp/ in the similar_item comparison table (regex, no DOM)."""
+    if not isinstance(similar_html, str) or "/dp/" not in similar_html:
+        return []
+    return DP_HREF_RE.findall(similar_html)
+
+def parse_product(obj: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Normalize one raw metadata record, or None if it has no ASIN."""
+    asin = obj.get("asin")
+    if not asin:
+        return None
+    title = obj.get("title") or ""
+    if not isinstance(title, str):
+        title = str(title)
 
+    desc = obj.get("description", "")
+    # Handle case where description is a list
+    if isinstance(desc, list):
+        desc = " ".join([str(d) for d in desc if d])
+    elif not isinstance(desc, str):
+        desc = str(desc) if desc else ""
+
+    related = extract_related_asins(obj.get("similar_item"))
+    for key in ["also_buy","also_viewed"]:
+        val = obj.get(key,[])
+        if isinstance(val,list):
+            related.extend(val)
+
+    return {
+        "asin": asin,
+        "title": title,
+        "description": desc,
+        "norm_title": normalize_text(title),
+        "norm_desc": normalize_text(desc),
+        "similar_item": related
+    }
+
+def _parse_batch(batch: List[Any]) -> List[Dict[str, Any]]:
+    out = []
+    for item in batch:
+        obj = json.loads(item) if isinstance(item, str) else item
+        rec = parse_product(obj)
+        if rec is not None:
+            out.append(rec)
+    return out
+
+def _ordered_map(pool: Executor, fn: Callable, items: Iterable[Any], window: int) -> Iterator[Any]:
+    # like pool.map, but keeps at most `window` items in flight instead of
+    # consuming the whole input iterator up front
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def default_cache_dir(path: str) -> str:
+    return path + ".cache"
+
+@instrument.timed("load_products")
+def load_products(path: str, n_jobs: int = 1, cache_dir: Optional[str] = None, use_cache: bool = True,
+                  batch_size: int = 2000) -> Mapping[str, Any]:
+    """Load products into a mapping keyed by ASIN with normalized fields.
+
+    Records are streamed and parsed in batches (across `n_jobs` processes when > 1,
+    with at most 2 * n_jobs batches in flight). The result is written as a columnar
+    cache (default `<path>.cache/`) that later calls memory-map instead of
+    re-parsing, as long as the source file is unchanged; a cache hit returns a
+    LazyProducts view that decodes each record on access.
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    if use_cache:
+        cols = open_product_cache(cache_dir, path)
+        if cols is not None:
+            instrument.count("product_cache_hits")
+            return LazyProducts(cols)
 
-def load_products(path: str) -> Dict[str, Any]:
-    """Load products into dict keyed by ASIN with normalized fields."""
     products = {}
-    for obj in read_json_lines(path):
-        asin = obj.get("asin")
-        if not asin:
-            continue
-        title = obj.get("title", "")
-
-        desc = obj.get("description", "")
-        # 🔥 Handle case where description is a list
-        if isinstance(desc, list):
-            desc = " ".join([str(d) for d in desc if d]) 
-            
-        related=[]
-        val=obj.get("similar_item",[])
-        soup = BeautifulSoup(val, "html.parser")
-
-        asins = []
-        for a in soup.find_all("a", href=True):
-            if "/dp/" in a["href"]:
-                asin = a["href"].split("/dp/")[1].split("/")[0]
-                asins.append(asin)
-                
-        related.extend(asins)
-       # print("simi")
-       # print(asins)
-        
-        for key in ["also_buy","also_viewed"]:
-            val=obj.get(key,[])
-            if isinstance(val,list):
-                #print(key)
-                #print(val)
-                related.extend(val) 
-                
-        print(asin)
-        print(title)
-        print(desc)
-        print(normalize_text(title))
-        print(normalize_text(desc))
-        related
-
-        products[asin] = {
-            "asin": asin,
-            "title": title,
-            "description": desc,
-            "norm_title": normalize_text(title),
-            "norm_desc": normalize_text(desc),
-            "similar_item": related
-        }
-        break
-    return products
+    batches = _iter_raw_batches(path, batch_size)
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            for recs in _ordered_map(pool, _parse_batch, batches, 2 * n_jobs):
+                for rec in recs:
+                    products[rec["asin"]] = rec
+    else:
+        for batch in batches:
+            for rec in _parse_batch(batch):
+                products[rec["asin"]] = rec
 
+    instrument.count("products_parsed", len(products))
+    if use_cache:
+        with instrument.stage("write_product_cache"):
+            write_product_cache(cache_dir, path, list(products.values()))
+    return products
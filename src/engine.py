@@ -0,0 +1,259 @@
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from bbit import PackedSignatures
+from data_loader import default_cache_dir, load_products
+from product_cache import LazyProducts, open_product_cache
+from shingling import union_rows
+from minhash_lsh import MinHasher, ArrayLSH
+from scoring import BlendedSignatures, score_candidates, sort_shingle_rows
+from signature_store import SignatureStore, open_signatures
+from text_clean import build_text
+from title_index import TitleIndex
+from tuner import tune
+
+
+# Shingles and signatures are built once per field; every mode is served from them
+FIELDS = {"title": "norm_title", "desc": "norm_desc"}
+MODE_FIELDS = {"PST": ("title",), "PSD": ("desc",), "PSTD": ("title", "desc")}
+
+
+class LRUCache:
+    """Small least-recently-used memo with a fixed number of entries."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        if key in self._data:
+            self._data.move_to_end(key)
+            return self._data[key]
+        value = compute()
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        return value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        return list(self._data.items())
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SimilarityEngine:
+    """Staged similar-product pipeline with one memo per stage.
+
+    load -> texts(mode) -> shingles(mode, K) -> signatures(mode, K, H) -> bands(mode, K, H, b, r)
+
+    Each stage only depends on the parameters to its left, so changing e.g. b/r
+    reuses the signatures and changing top_k or the query ASIN reuses everything.
+    Hashed shingles do not depend on H, and a smaller H is served as a column
+    prefix of any cached larger signature matrix.
+
+    Shingles and signatures are built per field (title, desc). PST and PSD are the
+    field signatures themselves, and PSTD is their elementwise minimum, which is
+    exactly the MinHash signature of the union of both shingle sets. Switching
+    modes therefore never re-signs the catalog.
+    """
+
+    def __init__(self, store_dir: Optional[str] = None, max_entries: int = 4, max_queries: int = 1024,
+                 min_shingles: int = 2):
+        self.store_dir = store_dir
+        self.min_shingles = min_shingles
+        self.path: Optional[str] = None
+        self.products: Mapping[str, dict] = {}
+        self.asins: List[str] = []
+        self.row_of: Dict[str, int] = {}
+        self._texts = LRUCache(max_entries)
+        self._shingles = LRUCache(max_entries)
+        self._sorted_shingles = LRUCache(max_entries)
+        self._signatures = LRUCache(max_entries)
+        self._packed = LRUCache(max_entries)
+        self._bands = LRUCache(max_entries)
+        self._queries = LRUCache(max_queries)
+        self._synced = set()  # signature keys known to match the on-disk store
+        self._title_index: Optional[TitleIndex] = None
+
+    def load(self, path: str) -> Mapping[str, dict]:
+        stamp = (path, os.stat(path).st_mtime_ns)
+        if stamp != self.path:
+            self.products = load_products(path)
+            self.asins = list(self.products.keys())
+            self.row_of = {asin: i for i, asin in enumerate(self.asins)}
+            for memo in (self._texts, self._shingles, self._sorted_shingles, self._signatures, self._packed, self._bands,
+                         self._queries):
+                memo.clear()
+            self._synced.clear()
+            self._title_index = None
+            self.path = stamp
+        return self.products
+
+    def texts(self, mode: str) -> List[str]:
+        """Texts of a mode (PST/PSD/PSTD) or of a single field (title/desc)."""
+        if mode in FIELDS:
+            if isinstance(self.products, LazyProducts):
+                # decode the cached column in one pass instead of record by record
+                return self._texts.get_or_compute(mode, lambda: self.products.texts(FIELDS[mode]))
+            return self._texts.get_or_compute(mode, lambda: [self.products[a][FIELDS[mode]] for a in self.asins])
+        return self._texts.get_or_compute(mode, lambda: [build_text(self.products[a], mode) for a in self.asins])
+
+    def search_titles(self, query: str, offset: int = 0, limit: int = 50) -> Tuple[List[str], bool]:
+        """One page of ASINs whose normalized title contains `query`, plus whether more follow.
+
+        Uses the trigram index persisted with the product cache, or builds it in memory.
+        """
+        if self.path is None:
+            raise RuntimeError("load() a catalog before searching titles")
+        if self._title_index is None:
+            path = self.path[0]
+            cols = open_product_cache(default_cache_dir(path), path)
+            self._title_index = cols.title_index() if cols is not None else TitleIndex.build(self.texts("title"))
+        rows, more = self._title_index.search(query, offset, limit)
+        return [self.asins[i] for i in rows], more
+
+    def shingles(self, mode: str, K: int) -> Tuple[np.ndarray, np.ndarray]:
+        fields = MODE_FIELDS.get(mode)
+        if fields is not None:
+            if len(fields) == 1:
+                return self.shingles(fields[0], K)
+            return self._shingles.get_or_compute(
+                (mode, K), lambda: union_rows(*(self.shingles(f, K) for f in fields)))
+        # token hashes do not depend on the number of hash functions
+        return self._shingles.get_or_compute(
+            (mode, K), lambda: MinHasher(1).hash_texts(self.texts(mode), K))
+
+    def signatures(self, mode: str, K: int, num_hashes: int) -> np.ndarray:
+        fields = MODE_FIELDS.get(mode)
+        if fields is not None and len(fields) == 1:
+            return self.signatures(fields[0], K, num_hashes)
+        key = (mode, K, num_hashes)
+        for (m, k, h), sigs in self._signatures.items():
+            if (m, k) == (mode, K) and h >= num_hashes:
+                return sigs[:, :num_hashes]
+
+        def build() -> np.ndarray:
+            if fields is not None:
+                # signature of a union of sets = elementwise minimum of their signatures
+                return np.minimum.reduce([self.signatures(f, K, num_hashes) for f in fields])
+            if not self.store_dir:
+                return MinHasher(num_hashes).signature_matrix(*self.shingles(mode, K))
+            store = SignatureStore(self.store_dir, mode, K, num_hashes)
+            sigs = open_signatures(store, self.asins, self.texts(mode),
+                                   lambda: MinHasher(num_hashes).signature_matrix(*self.shingles(mode, K)))
+            self._synced.add(key)
+            return sigs
+        return self._signatures.get_or_compute(key, build)
+
+    def bands(self, mode: str, K: int, num_hashes: int, b: int, r: int, max_bucket: int = 0) -> ArrayLSH:
+        """Band index; degenerate (too short) texts are kept out of the bands, buckets capped at max_bucket."""
+        def build() -> ArrayLSH:
+            sigs = self.signatures(mode, K, num_hashes)
+            store = self._store_for(mode, K, num_hashes)
+            if store is not None:
+                # the store holds exactly these signatures, so its band arrays can be reused
+                lsh = ArrayLSH.from_buckets(b, r, *store.bands(b, r), max_bucket=max_bucket)
+            else:
+                lsh = ArrayLSH(b, r, max_bucket=max_bucket).index(sigs)
+            if self.min_shingles > 0:
+                lsh.set_degenerate(sigs, self.shingle_counts(mode, K) < self.min_shingles)
+            return lsh
+        return self._bands.get_or_compute((mode, K, num_hashes, b, r, max_bucket), build)
+
+    def packed(self, mode: str, K: int, num_hashes: int, bits: int) -> PackedSignatures:
+        """b-bit packed signatures for scoring; the bands keep using the full-width ones."""
+        fields = MODE_FIELDS.get(mode)
+        if fields is not None and len(fields) == 1:
+            return self.packed(fields[0], K, num_hashes, bits)
+
+        def build() -> PackedSignatures:
+            store = self._store_for(mode, K, num_hashes)
+            if store is not None:
+                return store.packed(bits)
+            return PackedSignatures.from_signatures(self.signatures(mode, K, num_hashes), bits)
+        return self._packed.get_or_compute((mode, K, num_hashes, bits), build)
+
+    def _store_for(self, mode: str, K: int, num_hashes: int) -> Optional[SignatureStore]:
+        """The on-disk store holding exactly the signatures of `mode`, if they were synced with one."""
+        fields = MODE_FIELDS.get(mode, (mode,))
+        if len(fields) == 1 and (fields[0], K, num_hashes) in self._synced:
+            return SignatureStore(self.store_dir, fields[0], K, num_hashes)
+        return None
+
+    def suggest_bands(self, mode: str, K: int, threshold: float, recall_goal: float,
+                      hash_options: Tuple[int, ...] = (10, 20, 50, 100, 150)) -> Dict[str, float]:
+        """Best (num_hashes, b, r) from the tuner's cost model for the loaded catalog."""
+        return tune(None, K, threshold, recall_goal, hash_options=hash_options, shingles=self.shingles(mode, K))[0]
+
+    def shingle_counts(self, mode: str, K: int) -> np.ndarray:
+        """Distinct shingles per product; for PSTD those of the title/desc union, not of a concatenated text."""
+        fields = MODE_FIELDS.get(mode, (mode,))
+        if len(fields) > 1:
+            # union rows keep shingles present in both fields twice
+            return np.diff(self.sorted_shingles(mode, K)[1])
+        return np.diff(self.shingles(mode, K)[1])
+
+    def sorted_shingles(self, mode: str, K: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self._sorted_shingles.get_or_compute((mode, K), lambda: sort_shingle_rows(*self.shingles(mode, K)))
+
+    def query(self, asin: str, mode: str, K: int, num_hashes: int, b: int, r: int, top_k: int,
+              rerank_depth: int = 0, max_bucket: int = 0, bits: int = 0,
+              title_weight: float = 0.0) -> List[Tuple[str, float]]:
+        """Top-k (asin, score) neighbours of `asin` among its LSH candidates.
+
+        Scores are MinHash-Jaccard (from `bits`-bit packed signatures when > 0), or exact
+        Jaccard for the best `rerank_depth` candidates when > 0. For PSTD with
+        `title_weight` > 0 the score is title_weight * J(title) + (1 - title_weight) * J(desc)
+        instead of the Jaccard of the combined shingle sets.
+        """
+        return self.query_many([asin], mode, K, num_hashes, b, r, top_k, rerank_depth=rerank_depth,
+                               max_bucket=max_bucket, bits=bits, title_weight=title_weight)[0]
+
+    def query_many(self, asins: Sequence[str], mode: str, K: int, num_hashes: int, b: int, r: int, top_k: int,
+                   rerank_depth: int = 0, max_bucket: int = 0, bits: int = 0,
+                   title_weight: float = 0.0) -> List[List[Tuple[str, float]]]:
+        """query() for many ASINs; uncached ones share a single vectorized LSH lookup."""
+        params = (mode, K, num_hashes, b, r, top_k, rerank_depth, max_bucket, bits, title_weight)
+        results = [self._queries.get((asin,) + params) for asin in asins]
+        missing = list(dict.fromkeys(a for a, res in zip(asins, results) if res is None))
+        computed: Dict[str, List[Tuple[str, float]]] = {}
+        if missing:
+            sigs = self.signatures(mode, K, num_hashes)
+            lsh = self.bands(mode, K, num_hashes, b, r, max_bucket)
+            scorer = self._scorer(mode, K, num_hashes, bits, title_weight)
+            shingles = self.sorted_shingles(mode, K) if rerank_depth > 0 else None
+            rows = np.array([self.row_of[a] for a in missing], dtype=np.int64)
+            offsets, cand_ids = lsh.query_many(sigs[rows])
+            for i, (asin, q) in enumerate(zip(missing, rows)):
+                ids, scores = score_candidates(q, cand_ids[offsets[i]:offsets[i+1]], scorer, top_k,
+                                               shingles=shingles, rerank_depth=rerank_depth)
+                computed[asin] = [(self.asins[cid], float(sc)) for cid, sc in zip(ids, scores)]
+                self._queries.put((asin,) + params, computed[asin])
+        return [res if res is not None else computed[a] for a, res in zip(asins, results)]
+
+    def _scorer(self, mode: str, K: int, num_hashes: int, bits: int, title_weight: float):
+        def scorer_for(m: str):
+            return self.packed(m, K, num_hashes, bits) if bits else self.signatures(m, K, num_hashes)
+
+        if title_weight > 0 and len(MODE_FIELDS.get(mode, ())) > 1:
+            return BlendedSignatures([scorer_for(f) for f in MODE_FIELDS[mode]], [title_weight, 1.0 - title_weight])
+        return scorer_for(mode)
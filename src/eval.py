@@ -1,41 +1,21 @@
 import argparse
-from typing import Dict, List, Set, Tuple
+from typing import List, Set, Tuple
 import os
 import pandas as pd
-import numpy as np
 from collections import Counter
 
 from .data_loader import load_products
-from .shingling import char_k_shingles
-from .minhash_lsh import MinHasher, LSH, jaccard_from_sigs
-from .metrics import map_at_k
-
-def build_text(p: dict, mode: str) -> str:
-    if mode == "PST":
-        return p['norm_title']
-    if mode == "PSD":
-        return p['norm_desc']
-    # PSTD hybrid
-    return (p['norm_title'] + " " + p['norm_title'] + " " + p['norm_desc']).strip()
-
-def eval_once(products: Dict[str,dict], mode: str, K: int, num_hashes: int, b: int, r: int, top_k: int, eval_ids: List[str]) -> float:
-    # Shingles + signatures
-    shingles = {asin: char_k_shingles(build_text(p, mode), K) for asin,p in products.items()}
-    mh = MinHasher(num_hashes)
-    sigs = {asin: mh.signature(sh) for asin, sh in shingles.items()}
-    lsh = LSH(bands=b, rows=r)
-    index = lsh.index(sigs)
-
-    preds = {}
-    truth_sets = {asin: set(products[asin].get('similar_item', [])) for asin in eval_ids}
-    for q in eval_ids:
-        qsig = sigs[q]
-        cands = lsh.query_candidates(qsig, index)
-        cands.discard(q)
-        scored = [(cid, jaccard_from_sigs(qsig, sigs[cid])) for cid in cands]
-        scored.sort(key=lambda x: x[1], reverse=True)
-        preds[q] = [cid for cid,_ in scored[:top_k]]
-    return map_at_k(preds, truth_sets, top_k)
+from .text_clean import build_text
+from .sweep import SweepConfig, compare_field_modes, compare_hashers, run_probe_sweep, run_sweep
+from .tuner import tune, validate
+# the library modules import it by its top-level name; share that registry
+import instrument
+
+def fixed_config(n_hash_list: List[int]) -> Tuple[int, int, int]:
+    """(num_hashes, b, r) held fixed by the K sweep and the single-configuration reports."""
+    H = 100 if 100 in n_hash_list else n_hash_list[-1]
+    b, r = (20, H // 20) if H % 20 == 0 else (10, H // 10)
+    return H, b, r
 
 def main():
     ap = argparse.ArgumentParser()
@@ -46,17 +26,60 @@ def main():
     ap.add_argument("--b_list", nargs="+", type=int, default=[5,10,25,50])
     ap.add_argument("--r_list", nargs="+", type=int, default=[2,5,10])
     ap.add_argument("--top_k", type=int, default=10)
-    ap.add_argument("--eval_size", type=int, default=100)
+    ap.add_argument("--eval_size", type=int, default=100,
+                    help="evaluate the N products with the most similar_item entries (0 = all of them)")
+    ap.add_argument("--bootstrap", type=int, default=0,
+                    help="bootstrap resamples for confidence intervals in eval_metrics.csv (0 = skip that report)")
     ap.add_argument("--out_dir", default="reports")
+    ap.add_argument("--store_dir", default=None, help="directory for persisted signatures (reused across runs)")
+    ap.add_argument("--n_jobs", type=int, default=1, help="worker processes for independent (mode, K) builds")
+    ap.add_argument("--probes", nargs="+", type=int, default=[0],
+                    help="multi-probe budgets to compare per (b,r); a report is written if any is > 0")
+    ap.add_argument("--auto_tune", action="store_true", help="recommend (num_hashes, b, r) from the S-curve cost model")
+    ap.add_argument("--threshold", type=float, default=0.5, help="target similarity for --auto_tune")
+    ap.add_argument("--recall", type=float, default=0.9, help="recall goal at --threshold for --auto_tune")
+    ap.add_argument("--hasher", choices=["classic","oph","compare"], default="classic",
+                    help="MinHash variant; 'compare' also writes hasher_comparison.csv (MAP@10 and build time)")
+    ap.add_argument("--bits", type=int, choices=[0, 1, 2, 4, 8, 16], default=0,
+                    help="score candidates from b-bit packed signatures (0 = full 64-bit values)")
+    ap.add_argument("--field_check", action="store_true",
+                    help="compare PSTD from the joined text vs. per-field signatures (pstd_fields.csv)")
+    ap.add_argument("--title_weight", type=float, default=0.5, help="title weight of the blended PSTD score")
+    ap.add_argument("--max_bucket", type=int, default=0, help="cap LSH buckets at this size by sampling (0 = no cap)")
+    ap.add_argument("--min_shingles", type=int, default=0,
+                    help="texts too short for this many shingles bypass the bands (exact-signature match only)")
+    ap.add_argument("--instrument", action="store_true",
+                    help="record stage timings, candidate counts and bucket sizes (instrumentation.json); "
+                         "work done in --n_jobs worker processes is not included")
+    ap.add_argument("--rerank_depth", type=int, default=0, help="rerank this many top MinHash candidates by exact Jaccard (0 = off)")
     args = ap.parse_args()
 
+    fixed_hashes, fixed_b, fixed_r = fixed_config(args.n_hash_list)
+    if fixed_b * fixed_r != fixed_hashes:
+        wanted = [flag for flag, on in [("--bootstrap", args.bootstrap > 0), ("--hasher compare", args.hasher == "compare"),
+                                        ("--field_check", args.field_check)] if on]
+        if wanted:
+            ap.error(f"{', '.join(wanted)} need a fixed num_hashes ({fixed_hashes}) divisible by 10 "
+                     "(100 if in --n_hash_list, else its last value)")
+
+    if args.instrument:
+        instrument.enable()
+    run(args)
+    if args.instrument:
+        instrument.export_json(os.path.join(args.out_dir, "instrumentation.json"))
+        summary = instrument.report()
+        with open(os.path.join(args.out_dir, "instrumentation.txt"), "w") as f:
+            f.write(summary + "\n")
+        print("\n== Instrumentation ==\n" + summary)
+
+def run(args: argparse.Namespace) -> None:
     os.makedirs(args.out_dir, exist_ok=True)
     products = load_products(args.data)
 
     # Build evaluation set: top-N by number of similar_item
     counts = [(asin, len(p.get('similar_item', []))) for asin,p in products.items() if p.get('similar_item')]
     counts.sort(key=lambda x: x[1], reverse=True)
-    eval_ids = [asin for asin,_ in counts[:args.eval_size]]
+    eval_ids = [asin for asin,_ in (counts[:args.eval_size] if args.eval_size > 0 else counts)]
 
     if not eval_ids:
         print("No products with non-empty similar_item sets found in data.")
@@ -69,20 +92,29 @@ def main():
         f.write(f"Max given similar_item size: {max_given}\n")
         f.write(f"Min given similar_item size: {min_given}\n")
 
-    # Sweep K
-    rows = []
-    fixed_hashes = 100 if 100 in args.n_hash_list else args.n_hash_list[-1]
-    fixed_b, fixed_r = 20, fixed_hashes//20 if fixed_hashes%20==0 else (10, fixed_hashes//10)
+    if args.auto_tune:
+        asins = list(products.keys())
+        texts = [build_text(products[asin], args.mode) for asin in asins]
+        fixed_K = 5 if 5 in args.k_list else args.k_list[0]
+        ranked = tune(texts, fixed_K, args.threshold, args.recall, hash_options=args.n_hash_list)
+        pd.DataFrame(ranked).to_csv(os.path.join(args.out_dir, "tuning.csv"), index=False)
+        best = ranked[0]
+        check = validate(texts, fixed_K, best["num_hashes"], best["b"], best["r"], args.threshold)
+        print(f"Recommended num_hashes={best['num_hashes']} b={best['b']} r={best['r']} "
+              f"(predicted recall {best['recall_at_threshold']:.3f} at s={args.threshold}, "
+              f"~{best['pred_candidates']:.0f} candidates/query, {best['pred_index_mb']:.1f} MB); "
+              f"validated recall {check['measured_recall']:.3f} on {check['sample_size']} products")
+        return
+
+    # Collect every configuration of the three sweeps, then evaluate them together so
+    # shingles/signatures are shared per (mode, K) and only banding is redone per (b, r)
+    configs = []
+    fixed_hashes, fixed_b, fixed_r = fixed_config(args.n_hash_list)
     for K in args.k_list:
         if fixed_b * fixed_r != fixed_hashes:
             continue
-        score = eval_once(products, args.mode, K, fixed_hashes, fixed_b, fixed_r, args.top_k, eval_ids)
-        rows.append({"vary":"K","K":K,"num_hashes":fixed_hashes,"b":fixed_b,"r":fixed_r,"MAP@10":score})
-    df_k = pd.DataFrame(rows)
-    df_k.to_csv(os.path.join(args.out_dir, "map_by_K.csv"), index=False)
+        configs.append(SweepConfig("K", args.mode, K, fixed_hashes, fixed_b, fixed_r))
 
-    # Sweep num_hashes
-    rows = []
     fixed_K = 5 if 5 in args.k_list else args.k_list[0]
     for H in args.n_hash_list:
         # choose b,r so that b*r = H (simple factorization preference: r=5 if divisible)
@@ -94,26 +126,59 @@ def main():
             b = H // r
         if b*r != H or b==0:
             continue
-        score = eval_once(products, args.mode, fixed_K, H, b, r, args.top_k, eval_ids)
-        rows.append({"vary":"hashes","K":fixed_K,"num_hashes":H,"b":b,"r":r,"MAP@10":score})
-    df_h = pd.DataFrame(rows)
-    df_h.to_csv(os.path.join(args.out_dir, "map_by_hashes.csv"), index=False)
+        configs.append(SweepConfig("hashes", args.mode, fixed_K, H, b, r))
 
-    # Sweep (b,r) with fixed H
-    rows = []
+    # (b,r) with fixed H: enumerate factor pairs of H
     H = fixed_hashes
-    fixed_K = 5 if 5 in args.k_list else args.k_list[0]
-    # enumerate factor pairs of H
-    pairs = []
     for r in range(1, H+1):
         if H % r == 0:
-            b = H // r
-            pairs.append((b,r))
-    for b,r in pairs:
-        score = eval_once(products, args.mode, fixed_K, H, b, r, args.top_k, eval_ids)
-        rows.append({"vary":"bands_rows","K":fixed_K,"num_hashes":H,"b":b,"r":r,"MAP@10":score})
-    df_br = pd.DataFrame(rows)
-    df_br.to_csv(os.path.join(args.out_dir, "map_by_b_r.csv"), index=False)
+            configs.append(SweepConfig("bands_rows", args.mode, fixed_K, H, H // r, r))
+
+    asins = list(products.keys())
+    texts_by_mode = {args.mode: [build_text(products[asin], args.mode) for asin in asins]}
+    truth_sets = {asin: set(products[asin].get('similar_item', [])) for asin in eval_ids}
+    # precision/MAP/recall/nDCG with bootstrap CIs come from the same run as the sweep's MAP
+    fixed = SweepConfig("K", args.mode, fixed_K, fixed_hashes, fixed_b, fixed_r)
+    stats = {fixed: {}} if args.bootstrap > 0 and fixed in configs else None
+    with instrument.stage("eval.sweep"):
+        results = run_sweep(asins, texts_by_mode, configs, truth_sets, eval_ids, args.top_k,
+                            store_dir=args.store_dir, n_jobs=args.n_jobs, rerank_depth=args.rerank_depth,
+                            max_bucket=args.max_bucket, min_shingles=args.min_shingles,
+                            hasher="classic" if args.hasher == "compare" else args.hasher, bits=args.bits,
+                            stats=stats, n_bootstrap=args.bootstrap)
+
+    for vary, fname in [("K", "map_by_K.csv"), ("hashes", "map_by_hashes.csv"), ("bands_rows", "map_by_b_r.csv")]:
+        rows = [{"vary":cfg.vary,"K":cfg.K,"num_hashes":cfg.num_hashes,"b":cfg.b,"r":cfg.r,"MAP@10":score}
+                for cfg, score in results if cfg.vary == vary]
+        pd.DataFrame(rows).to_csv(os.path.join(args.out_dir, fname), index=False)
+
+    if args.hasher == "compare" and fixed_b * fixed_r == fixed_hashes:
+        rows = compare_hashers(asins, texts_by_mode[args.mode], fixed_K, fixed_hashes, fixed_b, fixed_r,
+                               truth_sets, eval_ids, args.top_k)
+        pd.DataFrame(rows).to_csv(os.path.join(args.out_dir, "hasher_comparison.csv"), index=False)
+
+    if args.field_check and fixed_b * fixed_r == fixed_hashes:
+        rows = compare_field_modes(asins, [products[a]['norm_title'] for a in asins],
+                                   [products[a]['norm_desc'] for a in asins],
+                                   [build_text(products[a], "PSTD") for a in asins],
+                                   fixed_K, fixed_hashes, fixed_b, fixed_r, truth_sets, eval_ids, args.top_k,
+                                   title_weight=args.title_weight)
+        pd.DataFrame(rows).to_csv(os.path.join(args.out_dir, "pstd_fields.csv"), index=False)
+
+    # precision/MAP/recall/nDCG at the fixed configuration, with bootstrap confidence intervals
+    if stats is not None:
+        row = {"K": fixed_K, "num_hashes": fixed_hashes, "b": fixed_b, "r": fixed_r, "eval_size": len(eval_ids)}
+        row.update(stats[fixed])
+        pd.DataFrame([row]).to_csv(os.path.join(args.out_dir, "eval_metrics.csv"), index=False)
+
+    # Multi-probe: fewer bands + probes vs. more bands, with candidate counts and index size
+    if any(p > 0 for p in args.probes):
+        pairs = [(H // r, r) for r in range(1, H+1) if H % r == 0]
+        probe_list = sorted(set([0] + args.probes))
+        rows = run_probe_sweep(asins, texts_by_mode[args.mode], fixed_K, H, pairs, probe_list, truth_sets,
+                               eval_ids, args.top_k, store_dir=args.store_dir, mode=args.mode,
+                               hasher="classic" if args.hasher == "compare" else args.hasher)
+        pd.DataFrame(rows).to_csv(os.path.join(args.out_dir, "map_by_probes.csv"), index=False)
 
     print("Saved results to", args.out_dir)
 
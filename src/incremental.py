@@ -0,0 +1,169 @@
+from collections import defaultdict
+from typing import DefaultDict, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from data_loader import parse_product, read_json_lines
+from text_clean import build_text
+from minhash_lsh import MinHasher, ArrayLSH, band_keys
+from scoring import score_candidates
+from shingling import char_k_shingle_hashes, normalize_and_shingle
+from signature_store import SignatureStore
+
+
+class UpdatableIndex:
+    """MinHash/LSH index that accepts upserts and removals without a full rebuild.
+
+    Rows are append-only: an upsert writes a new signature row and tombstones the
+    ASIN's previous row, a removal only tombstones. Rows added since the last
+    compaction live in small per-band dict buckets next to the array-backed
+    ArrayLSH over the compacted rows. `compact()` drops tombstones and folds the
+    new rows into fresh band arrays; it runs automatically once dead plus pending
+    rows exceed `compact_ratio` of the live rows.
+    """
+
+    def __init__(self, mode: str, K: int, num_hashes: int, b: int, r: int, seed: int = 42,
+                 compact_ratio: float = 0.2):
+        assert b * r == num_hashes
+        self.mode = mode
+        self.K = K
+        self.mh = MinHasher(num_hashes, seed)
+        self.b = b
+        self.r = r
+        self.compact_ratio = compact_ratio
+        self.asins: List[Optional[str]] = []
+        self.row_of: Dict[str, int] = {}
+        self.sigs = np.empty((0, num_hashes), dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self.n_rows = 0
+        self.base = ArrayLSH(b, r).index(self.sigs)
+        self.n_base = 0
+        self.delta: DefaultDict[Tuple[int, int], List[int]] = defaultdict(list)
+        self.n_dead = 0
+
+    @classmethod
+    def from_store(cls, store: SignatureStore, b: int, r: int, **kwargs) -> "UpdatableIndex":
+        idx = cls(store.mode, store.K, store.num_hashes, b, r, seed=store.seed, **kwargs)
+        asins, sigs = store.load()
+        idx.asins = asins.tolist()
+        idx.row_of = {asin: i for i, asin in enumerate(idx.asins)}
+        idx.sigs = np.array(sigs)  # private, growable copy
+        idx.n_rows = idx.n_base = len(idx.asins)
+        idx.alive = np.ones(idx.n_rows, dtype=bool)
+        idx.base = ArrayLSH.from_buckets(b, r, *store.bands(b, r))
+        return idx
+
+    def __len__(self) -> int:
+        return self.n_rows - self.n_dead
+
+    def __contains__(self, asin: str) -> bool:
+        return asin in self.row_of
+
+    def signature_of_text(self, text: str) -> np.ndarray:
+        return self.mh.signature(normalize_and_shingle(text, self.K))
+
+    def _append(self, asin: str, sig: np.ndarray) -> int:
+        if self.n_rows == len(self.sigs):
+            # grow geometrically so a day of upserts costs amortized O(1) copies
+            cap = max(16, 2 * len(self.sigs))
+            sigs = np.empty((cap, self.sigs.shape[1]), dtype=np.int64)
+            sigs[:self.n_rows] = self.sigs[:self.n_rows]
+            alive = np.zeros(cap, dtype=bool)
+            alive[:self.n_rows] = self.alive[:self.n_rows]
+            self.sigs, self.alive = sigs, alive
+        row = self.n_rows
+        self.sigs[row] = sig
+        self.alive[row] = True
+        self.asins.append(asin)
+        self.row_of[asin] = row
+        self.n_rows += 1
+        for band, key in enumerate(band_keys(sig, self.b, self.r)[0].tolist()):
+            self.delta[(band, key)].append(row)
+        return row
+
+    def _tombstone(self, asin: str) -> bool:
+        row = self.row_of.pop(asin, None)
+        if row is None:
+            return False
+        self.alive[row] = False
+        self.asins[row] = None
+        self.n_dead += 1
+        return True
+
+    def upsert(self, asin: str, text: str) -> None:
+        """Insert or replace `asin` with the signature of `text` (normalized here)."""
+        self.upsert_signature(asin, self.signature_of_text(text))
+
+    def upsert_signature(self, asin: str, sig: np.ndarray) -> None:
+        self._tombstone(asin)
+        self._append(asin, sig)
+        self._maybe_compact()
+
+    def remove(self, asin: str) -> bool:
+        removed = self._tombstone(asin)
+        self._maybe_compact()
+        return removed
+
+    def _maybe_compact(self) -> None:
+        pending = self.n_dead + (self.n_rows - self.n_base)
+        if pending > self.compact_ratio * max(len(self), 1) and pending > 1024:
+            self.compact()
+
+    def compact(self) -> None:
+        """Drop tombstoned rows and rebuild the band arrays over all live rows."""
+        keep = np.flatnonzero(self.alive[:self.n_rows])
+        self.sigs = self.sigs[keep]
+        self.alive = np.ones(len(keep), dtype=bool)
+        self.asins = [self.asins[i] for i in keep.tolist()]
+        self.row_of = {asin: i for i, asin in enumerate(self.asins)}
+        self.n_rows = self.n_base = len(keep)
+        self.n_dead = 0
+        self.base = ArrayLSH(self.b, self.r).index(self.sigs)
+        self.delta.clear()
+
+    def query_candidates(self, sig: np.ndarray) -> np.ndarray:
+        """Live row ids sharing a bucket with `sig` in at least one band."""
+        rows = [self.base.query_candidates(sig)] if self.n_base else []
+        for band, key in enumerate(band_keys(sig, self.b, self.r)[0].tolist()):
+            hit = self.delta.get((band, key))
+            if hit:
+                rows.append(np.array(hit, dtype=np.int32))
+        if not rows:
+            return np.zeros(0, dtype=np.int32)
+        rows = np.unique(np.concatenate(rows))
+        return rows[self.alive[rows]]
+
+    def query(self, asin: str, top_k: int) -> List[Tuple[str, float]]:
+        """Top-k (asin, MinHash-Jaccard) neighbours of an indexed ASIN."""
+        q = self.row_of[asin]
+        ids, scores = score_candidates(q, self.query_candidates(self.sigs[q]), self.sigs, top_k)
+        return [(self.asins[i], float(s)) for i, s in zip(ids.tolist(), scores.tolist())]
+
+    def apply_delta(self, path: str) -> Tuple[int, int]:
+        """Apply a JSON-lines delta file; returns (upserted, removed).
+
+        Each line is either a raw metadata record (upserted, texts built as for
+        `mode`) or {"asin": ..., "op": "delete"}.
+        """
+        upserted = removed = 0
+        for obj in read_json_lines(path):
+            if obj.get("op") == "delete":
+                removed += int(self.remove(obj["asin"]))
+                continue
+            rec = parse_product(obj)
+            if rec is None:
+                continue
+            text = build_text(rec, self.mode)
+            self.upsert_signature(rec["asin"], self.mh.signature(char_k_shingle_hashes(text, self.K)))
+            upserted += 1
+        return upserted, removed
+
+    def save(self, store: SignatureStore) -> None:
+        """Compact and persist signatures and band arrays to `store`.
+
+        The index does not keep product texts, so the store gets no content digest:
+        UpdatableIndex.from_store still reopens it, but open_signatures re-signs.
+        """
+        self.compact()
+        store.save(self.asins, self.sigs)
+        store.save_bands(self.b, self.r, self.base.keys_sorted, self.base.order)
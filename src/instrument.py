@@ -0,0 +1,163 @@
+import functools
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterator, List, Union
+
+import numpy as np
+
+# Process-wide stage timers, counters and histograms for the pipeline. Disabled by
+# default: stage() then returns a shared no-op context manager and count()/observe()
+# return after one flag check, so the hooks in the hot paths cost next to nothing.
+_enabled = False
+_NOOP = nullcontext()
+
+
+class Timer:
+    """Call count, total and max wall time of one stage."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"count": self.count, "total_s": self.total, "mean_ms": 1000 * self.total / max(self.count, 1),
+                "max_ms": 1000 * self.max}
+
+
+class Histogram:
+    """Power-of-two bucketed distribution of non-negative values.
+
+    Bucket i counts values in [2^(i-1), 2^i) (bucket 0 holds values < 1), so
+    quantiles are upper bounds accurate to a factor of two.
+    """
+
+    N_BUCKETS = 48
+
+    def __init__(self):
+        self.buckets = np.zeros(self.N_BUCKETS, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return
+        idx = np.zeros(len(values), dtype=np.int64)
+        pos = values >= 1
+        idx[pos] = np.floor(np.log2(values[pos])).astype(np.int64) + 1
+        np.add.at(self.buckets, np.minimum(idx, self.N_BUCKETS - 1), 1)
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.max = max(self.max, float(values.max()))
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        i = int(np.searchsorted(np.cumsum(self.buckets), q * self.count))
+        return float(min(2.0 ** i, self.max)) if i > 0 else min(1.0, self.max)
+
+    def to_dict(self) -> Dict[str, object]:
+        nz = np.flatnonzero(self.buckets)
+        return {"count": self.count, "mean": self.total / max(self.count, 1), "max": self.max,
+                "p50": self.quantile(0.5), "p99": self.quantile(0.99),
+                "buckets": {("<1" if i == 0 else f"<{2 ** i}"): int(self.buckets[i]) for i in nz}}
+
+
+_timers: Dict[str, Timer] = {}
+_counters: Dict[str, int] = {}
+_histograms: Dict[str, Histogram] = {}
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    _timers.clear()
+    _counters.clear()
+    _histograms.clear()
+
+
+@contextmanager
+def _timed(name: str) -> Iterator[None]:
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        _timers.setdefault(name, Timer()).add(time.perf_counter() - t)
+
+
+def stage(name: str):
+    """Context manager timing one pipeline stage (no-op while disabled)."""
+    return _timed(name) if _enabled else _NOOP
+
+
+def timed(name: str) -> Callable:
+    """Decorator form of stage(); while disabled it only adds one flag check per call."""
+    def decorate(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _timed(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name: str, n: int = 1) -> None:
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + int(n)
+
+
+def observe(name: str, values: Union[float, np.ndarray, List[float]]) -> None:
+    """Add one value or an array of values to a histogram."""
+    if _enabled:
+        _histograms.setdefault(name, Histogram()).add(values)
+
+
+def snapshot() -> Dict[str, Dict[str, object]]:
+    return {"timers": {k: t.to_dict() for k, t in _timers.items()},
+            "counters": dict(_counters),
+            "histograms": {k: h.to_dict() for k, h in _histograms.items()}}
+
+
+def export_json(path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(snapshot(), f, indent=2)
+
+
+def report() -> str:
+    """Plain-text summary of every timer, counter and histogram."""
+    snap = snapshot()
+    lines = ["stage timings:"]
+    for name, t in sorted(snap["timers"].items(), key=lambda kv: -kv[1]["total_s"]):
+        lines.append(f"  {name:28s} {t['total_s']:9.3f}s total  {t['count']:8d} calls  "
+                     f"{t['mean_ms']:9.3f} ms mean  {t['max_ms']:9.3f} ms max")
+    if snap["counters"]:
+        lines.append("counters:")
+        lines += [f"  {name:28s} {value}" for name, value in sorted(snap["counters"].items())]
+    if snap["histograms"]:
+        lines.append("histograms:")
+        for name, h in sorted(snap["histograms"].items()):
+            lines.append(f"  {name:28s} n={h['count']} mean={h['mean']:.1f} p50<={h['p50']:.0f} "
+                         f"p99<={h['p99']:.0f} max={h['max']:.0f}")
+    return "\n".join(lines)
@@ -1,4 +1,6 @@
-from typing import List, Set, Dict
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
 
 def precision_at_k(pred: List[str], truth: Set[str], k: int) -> float:
     if k <= 0:
@@ -28,3 +30,93 @@ def map_at_k(all_preds: Dict[str, List[str]], truth_sets: Dict[str, Set[str]], k
         total += ap
         n += 1
     return total / max(n,1)
+
+# Batch evaluation: predictions are an (n_queries, k) matrix of int item ids padded
+# with -1, ground truth is CSR (offsets, ids) with query i owning ids[offsets[i]:offsets[i+1]].
+
+def truth_csr(truth_lists: Sequence[Iterable[str]], row_of: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """CSR of the catalog rows in each truth list, plus each list's full size.
+
+    Ids missing from `row_of` cannot be predicted but still count towards the
+    number of relevant items, as they do in average_precision_at_k.
+    """
+    sizes = np.zeros(len(truth_lists), dtype=np.int64)
+    rows: List[np.ndarray] = []
+    for i, truth in enumerate(truth_lists):
+        truth = set(truth)
+        sizes[i] = len(truth)
+        rows.append(np.unique(np.array([row_of[t] for t in truth if t in row_of], dtype=np.int64)))
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(r) for r in rows], out=offsets[1:])
+    ids = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    return offsets, ids, sizes
+
+
+def relevance_matrix(pred: np.ndarray, truth_offsets: np.ndarray, truth_ids: np.ndarray) -> np.ndarray:
+    """Boolean (n_queries, k): whether pred[i, j] is in query i's truth row."""
+    pred = np.asarray(pred, dtype=np.int64)
+    n = pred.shape[0]
+    span = np.int64(max(int(pred.max(initial=0)), int(truth_ids.max(initial=0))) + 1)
+    # (query, id) codes; truth rows are sorted, so the truth codes are sorted too
+    truth_codes = np.repeat(np.arange(n, dtype=np.int64), np.diff(truth_offsets)) * span + truth_ids
+    if len(truth_codes) == 0:
+        return np.zeros(pred.shape, dtype=bool)
+    codes = np.arange(n, dtype=np.int64)[:, None] * span + pred
+    idx = np.minimum(np.searchsorted(truth_codes, codes), len(truth_codes) - 1)
+    return (truth_codes[idx] == codes) & (pred >= 0)
+
+
+def per_query_metrics(pred: np.ndarray, truth_offsets: np.ndarray, truth_ids: np.ndarray, k: int,
+                      n_relevant: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """precision@k, AP@k, recall@k and nDCG@k (binary gains) for every query.
+
+    Matches precision_at_k / average_precision_at_k query by query. `n_relevant`
+    overrides the truth-row lengths (see truth_csr).
+    """
+    pred = np.asarray(pred)[:, :k]
+    rel = relevance_matrix(pred, truth_offsets, truth_ids).astype(np.float64)
+    if rel.shape[1] < k:
+        rel = np.pad(rel, ((0, 0), (0, k - rel.shape[1])))
+    n_rel = np.diff(truth_offsets) if n_relevant is None else np.asarray(n_relevant)
+    n_rel = n_rel.astype(np.float64)
+    hits = rel.sum(axis=1)
+    ranks = np.arange(1, k + 1, dtype=np.float64)
+    ap = (np.cumsum(rel, axis=1) / ranks * rel).sum(axis=1)
+    discounts = 1.0 / np.log2(ranks + 1)
+    ideal = np.cumsum(discounts)[np.minimum(n_rel, k).astype(np.int64) - 1]
+    has_truth = n_rel > 0
+    safe = np.where(has_truth, n_rel, 1.0)
+    return {
+        "precision": hits / k if k > 0 else np.zeros(len(rel)),
+        "map": np.where(has_truth, ap / np.minimum(safe, k), 0.0),
+        "recall": np.where(has_truth, hits / safe, 0.0),
+        "ndcg": np.where(has_truth, (rel * discounts).sum(axis=1) / np.where(has_truth, ideal, 1.0), 0.0),
+    }
+
+
+def batch_metrics(pred: np.ndarray, truth_offsets: np.ndarray, truth_ids: np.ndarray, k: int,
+                  n_relevant: Optional[np.ndarray] = None, n_bootstrap: int = 0, alpha: float = 0.05,
+                  seed: int = 0) -> Dict[str, float]:
+    """Mean precision@k, MAP@k, recall@k and nDCG@k over all queries.
+
+    With `n_bootstrap` > 0, also `<metric>_ci_low` / `<metric>_ci_high`: the
+    percentile bootstrap (1 - alpha) interval of each mean over resampled queries.
+    """
+    per_query = per_query_metrics(pred, truth_offsets, truth_ids, k, n_relevant)
+    out = {name: float(vals.mean()) if len(vals) else 0.0 for name, vals in per_query.items()}
+    n = len(per_query["map"])
+    if n_bootstrap > 0 and n > 0:
+        rng = np.random.default_rng(seed)
+        stacked = np.stack(list(per_query.values()), axis=1)  # (n, n_metrics)
+        means = []
+        # resample in blocks so the (block, n) weight matrix stays small
+        block = max(1, (1 << 22) // n)
+        for lo in range(0, n_bootstrap, block):
+            weights = rng.multinomial(n, np.full(n, 1.0 / n), size=min(block, n_bootstrap - lo))
+            means.append(weights @ stacked / n)
+        means = np.concatenate(means)
+        low, high = np.percentile(means, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+        for j, name in enumerate(per_query):
+            out[f"{name}_ci_low"] = float(low[j])
+            out[f"{name}_ci_high"] = float(high[j])
+    return out
@@ -1,29 +1,50 @@
 import random
 import math
-from typing import List, Dict, Tuple, Iterable, Set, DefaultDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple, Iterable, Set, DefaultDict, Optional, Union
 from collections import defaultdict
 import numpy as np
 
+import instrument
+from shingling import batch_shingle_hashes, hash_bytes
+
+# Bump whenever token or band hashing changes so persisted stores are rebuilt
+HASH_VERSION = 3
+
 class MinHasher:
+    # signature columns [:n] equal MinHasher(n)'s signature (see __init__)
+    prefix_stable = True
+
     def __init__(self, num_hashes: int, seed: int = 42):
         self.num_hashes = num_hashes
         self.seed = seed
-        random.seed(seed)
+        rng = random.Random(seed)
         # Universal hashing: h(x) = (a*x + b) mod p mod m
-        # We map shingles to integers using Python's built-in hash (stable within session not guaranteed),
-        # so we further mask to positive and mod a large prime.
+        # Shingles are mapped to integers with shingling.hash_bytes (deterministic, unlike
+        # Python's salted hash()), the same hash the vectorized byte path emits.
         self.p = 2_147_483_647  # large prime
-        self.a = np.array([random.randrange(1, self.p-1) for _ in range(num_hashes)], dtype=np.int64)
-        self.b = np.array([random.randrange(0, self.p-1) for _ in range(num_hashes)], dtype=np.int64)
+        # (a, b) are drawn pairwise so MinHasher(n) is a prefix of MinHasher(m) for n <= m:
+        # signature columns [:n] of a larger hasher equal the smaller hasher's signature.
+        pairs = [(rng.randrange(1, self.p-1), rng.randrange(0, self.p-1)) for _ in range(num_hashes)]
+        self.a = np.array([a for a, _ in pairs], dtype=np.int64).reshape(num_hashes)
+        self.b = np.array([b for _, b in pairs], dtype=np.int64).reshape(num_hashes)
 
     def _hash_token(self, token: str) -> int:
-        # stable-ish mapping to non-negative 64-bit
-        return (hash(token) & 0x7FFFFFFFFFFFFFFF) % self.p
+        # deterministic mapping to non-negative 64-bit
+        return (hash_bytes(token.encode("utf-8")) & 0x7FFFFFFFFFFFFFFF) % self.p
+
+    def field_values(self, hashes: np.ndarray) -> np.ndarray:
+        """Map raw uint64 shingle hashes (shingling.batch_shingle_hashes) to the [0, p) inputs of h(x)."""
+        return ((np.asarray(hashes, dtype=np.uint64) & np.uint64(0x7FFFFFFFFFFFFFFF)) % np.uint64(self.p)).astype(np.int64)
 
-    def signature(self, shingles: Set[str]) -> np.ndarray:
-        if not shingles:
+    def signature(self, shingles: Union[Set[str], np.ndarray]) -> np.ndarray:
+        """Signature of a shingle set, or of a uint64 shingle-hash array (identical result)."""
+        if len(shingles) == 0:
             return np.full(self.num_hashes, fill_value=self.p, dtype=np.int64)
-        vals = np.array([self._hash_token(t) for t in shingles], dtype=np.int64)
+        if isinstance(shingles, np.ndarray):
+            vals = self.field_values(shingles)
+        else:
+            vals = np.array([self._hash_token(t) for t in shingles], dtype=np.int64)
         # For each hash function, compute min over tokens
         # sig[i] = min( (a[i]*x + b[i]) mod p for x in vals )
         av = (self.a.reshape(-1,1) * vals.reshape(1,-1)) % self.p
@@ -31,6 +52,266 @@ class MinHasher:
         sig = avb.min(axis=1)
         return sig
 
+    def hash_shingles(self, shingle_sets: Iterable[Set[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        # Flatten many shingle sets into CSR layout: item i owns values[offsets[i]:offsets[i+1]]
+        values: List[int] = []
+        offsets = [0]
+        for shingles in shingle_sets:
+            values.extend(self._hash_token(t) for t in shingles)
+            offsets.append(len(values))
+        return np.array(values, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+    def hash_texts(self, texts: Iterable[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Same CSR layout as hash_shingles(char_k_shingles(t, k) for t in texts), without shingle strings."""
+        hashes, offsets = batch_shingle_hashes(texts, k)
+        return self.field_values(hashes), offsets
+
+    @instrument.timed("signature_matrix")
+    def signature_matrix(self, values: np.ndarray, offsets: np.ndarray,
+                         chunk_size: int = 1 << 20, n_jobs: int = 1) -> np.ndarray:
+        """Signatures for all items of a CSR shingle layout, shape (n_items, num_hashes).
+
+        Rows are identical to calling `signature` per item. Work is split into
+        chunks of roughly `chunk_size` hashed shingles so the temporary stays bounded;
+        with n_jobs > 1 the chunks are spread over a process pool.
+        """
+        values = np.asarray(values, dtype=np.int64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        n_items = len(offsets) - 1
+        out = np.empty((n_items, self.num_hashes), dtype=np.int64)
+        # Keep the (num_hashes x chunk) temporary around chunk_size elements
+        budget = max(1, chunk_size // max(self.num_hashes, 1))
+        bounds = _chunk_bounds(offsets, budget)
+        tasks = [(lo, hi, values[offsets[lo]:offsets[hi]], offsets[lo:hi+1] - offsets[lo]) for lo, hi in bounds]
+        chunk_fn, params = self._chunk_job()
+        if n_jobs > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                futures = [(lo, hi, pool.submit(chunk_fn, *params, vals, offs))
+                           for lo, hi, vals, offs in tasks]
+                for lo, hi, fut in futures:
+                    out[lo:hi] = fut.result()
+        else:
+            for lo, hi, vals, offs in tasks:
+                out[lo:hi] = chunk_fn(*params, vals, offs)
+        instrument.count("signatures", n_items)
+        return out
+
+    def _chunk_job(self):
+        # (picklable chunk function, leading arguments) used by signature_matrix
+        return _signature_chunk, (self.a, self.b, self.p)
+
+    def runner_up(self, shingles: Set[str]) -> np.ndarray:
+        """Second-smallest distinct hash value per hash function (-1 where there is none).
+
+        Used for multi-probe queries: a near neighbour whose minimum differs from
+        the query's most likely has the query's runner-up value instead.
+        """
+        values, offsets = self.hash_shingles([shingles])
+        return self.runner_up_matrix(values, offsets)[0]
+
+    def runner_up_matrix(self, values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.int64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        out = np.empty((len(offsets) - 1, self.num_hashes), dtype=np.int64)
+        budget = max(1, (1 << 20) // max(self.num_hashes, 1))
+        for lo, hi in _chunk_bounds(offsets, budget):
+            vals = values[offsets[lo]:offsets[hi]]
+            out[lo:hi] = _runner_up_chunk(self.a, self.b, self.p, vals, offsets[lo:hi+1] - offsets[lo])
+        return out
+
+class OnePermMinHasher(MinHasher):
+    """One-permutation MinHash with densification: O(n_shingles) per document.
+
+    A single universal hash h(x) = (a*x + b) mod p is split into `num_hashes`
+    equal ranges (bins); signature entry i is the smallest offset of h within
+    bin i. Empty bins borrow the value of another bin along a fixed, seeded
+    probe sequence (optimal densification), so entries stay comparable across
+    documents. Drop-in for MinHasher: signatures feed LSH, ArrayLSH and
+    jaccard_from_sigs unchanged. Unlike MinHasher, a smaller hasher is not a
+    column prefix of a larger one. Runner-up values are the second-smallest
+    offset within each bin, borrowed along with the minimum for empty bins.
+    """
+
+    prefix_stable = False
+
+    def __init__(self, num_hashes: int, seed: int = 42, probe_len: int = 32):
+        super().__init__(num_hashes, seed)
+        rng = np.random.default_rng(seed)
+        self.bin_width = -(-self.p // num_hashes)
+        self.probe_table = rng.integers(0, num_hashes, size=(num_hashes, min(probe_len, num_hashes))).astype(np.int64)
+
+    def signature(self, shingles: Union[Set[str], np.ndarray]) -> np.ndarray:
+        if len(shingles) == 0:
+            return np.full(self.num_hashes, fill_value=self.p, dtype=np.int64)
+        if isinstance(shingles, np.ndarray):
+            vals = self.field_values(shingles)
+        else:
+            vals = np.array([self._hash_token(t) for t in shingles], dtype=np.int64)
+        return self.signature_matrix(vals, np.array([0, len(vals)], dtype=np.int64))[0]
+
+    def _chunk_job(self):
+        return _oph_chunk, (int(self.a[0]), int(self.b[0]), self.p, self.bin_width, self.probe_table)
+
+    def runner_up_matrix(self, values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.int64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        out = np.empty((len(offsets) - 1, self.num_hashes), dtype=np.int64)
+        _, params = self._chunk_job()
+        for lo, hi in _chunk_bounds(offsets, 1 << 20):
+            vals = values[offsets[lo]:offsets[hi]]
+            out[lo:hi] = _oph_chunk(*params, vals, offsets[lo:hi+1] - offsets[lo], runner_up=True)
+        return out
+
+def _oph_chunk(a: int, b: int, p: int, width: int, probe_table: np.ndarray,
+               vals: np.ndarray, offsets: np.ndarray, runner_up: bool = False) -> np.ndarray:
+    # signatures, or with runner_up=True the second-smallest distinct offset per bin (-1 if none)
+    n_items = len(offsets) - 1
+    m = probe_table.shape[0]
+    sig = np.full((n_items, m), fill_value=width, dtype=np.int64)  # width marks an empty bin
+    second = np.full((n_items, m), fill_value=-1, dtype=np.int64) if runner_up else sig
+    if len(vals):
+        h = (a * vals % p + b) % p
+        item = np.repeat(np.arange(n_items, dtype=np.int64), np.diff(offsets))
+        cell = item * m + h // width
+        # smallest in-bin offset per (item, bin): sort by cell then offset, keep the first
+        off = h % width
+        order = np.lexsort((off, cell))
+        cell, off = cell[order], off[order]
+        first = np.r_[True, cell[1:] != cell[:-1]]
+        sig.ravel()[cell[first]] = off[first]
+        if runner_up:
+            # first offset of each cell that differs from the cell's minimum
+            head = np.maximum.accumulate(np.where(first, np.arange(len(cell)), 0))
+            differs = off != off[head]
+            cell2, off2 = cell[differs], off[differs]
+            first2 = np.r_[True, cell2[1:] != cell2[:-1]]
+            second.ravel()[cell2[first2]] = off2[first2]
+    empty = sig == width
+    need = empty.copy()
+    need[empty.all(axis=1)] = False  # nothing to borrow from; handled below
+    for t in range(probe_table.shape[1]):
+        if not need.any():
+            break
+        src = probe_table[:, t]
+        take = need & ~empty[:, src]
+        sig[take] = sig[:, src][take]
+        if runner_up:
+            second[take] = second[:, src][take]
+        need &= ~take
+    shift = 1
+    while need.any():
+        # rotation fallback: next non-empty bin to the right
+        src = (np.arange(m) + shift) % m
+        take = need & ~empty[:, src]
+        sig[take] = sig[:, src][take]
+        if runner_up:
+            second[take] = second[:, src][take]
+        need &= ~take
+        shift += 1
+    if runner_up:
+        return second
+    sig[empty.all(axis=1)] = p
+    return sig
+
+def _chunk_bounds(offsets: np.ndarray, budget: int) -> List[Tuple[int, int]]:
+    # Greedy split of items into runs whose total shingle count stays near budget
+    bounds = []
+    n_items = len(offsets) - 1
+    lo = 0
+    while lo < n_items:
+        hi = int(np.searchsorted(offsets, offsets[lo] + budget, side="right")) - 1
+        hi = min(max(hi, lo + 1), n_items)
+        bounds.append((lo, hi))
+        lo = hi
+    return bounds
+
+def _signature_chunk(a: np.ndarray, b: np.ndarray, p: int, vals: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    n_items = len(offsets) - 1
+    sig = np.full((n_items, len(a)), fill_value=p, dtype=np.int64)
+    if len(vals) == 0:
+        return sig
+    av = (a.reshape(-1,1) * vals.reshape(1,-1)) % p
+    avb = (av + b.reshape(-1,1)) % p
+    # reduceat needs valid start indices, so only reduce over non-empty items
+    nonempty = offsets[1:] > offsets[:-1]
+    starts = offsets[:-1][nonempty]
+    sig[nonempty] = np.minimum.reduceat(avb, starts, axis=1).T
+    return sig
+
+def _runner_up_chunk(a: np.ndarray, b: np.ndarray, p: int, vals: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    n_items = len(offsets) - 1
+    out = np.full((n_items, len(a)), fill_value=-1, dtype=np.int64)
+    if len(vals) == 0:
+        return out
+    avb = ((a.reshape(-1,1) * vals.reshape(1,-1)) % p + b.reshape(-1,1)) % p
+    nonempty = offsets[1:] > offsets[:-1]
+    starts = offsets[:-1][nonempty]
+    counts = np.diff(offsets)[nonempty]
+    mins = np.minimum.reduceat(avb, starts, axis=1)
+    # mask every occurrence of the minimum, then the next minimum is the runner-up
+    avb[avb == np.repeat(mins, counts, axis=1)] = p
+    second = np.minimum.reduceat(avb, starts, axis=1).T
+    second[second == p] = -1
+    out[nonempty] = second
+    return out
+
+_MIX_PRIME = np.uint64(0x100000001B3)
+
+def band_keys(sig_matrix: np.ndarray, bands: int, rows: int) -> np.ndarray:
+    """Deterministic uint64 bucket key per (item, band), shape (n_items, bands)."""
+    sig_matrix = np.atleast_2d(np.asarray(sig_matrix)).astype(np.uint64)
+    n_items = sig_matrix.shape[0]
+    keys = np.empty((n_items, bands), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for band in range(bands):
+            h = np.full(n_items, 0xCBF29CE484222325, dtype=np.uint64)
+            for j in range(band * rows, (band + 1) * rows):
+                h = (h ^ sig_matrix[:, j]) * _MIX_PRIME
+            # splitmix64 finalizer spreads the low bits
+            h ^= h >> np.uint64(30)
+            h *= np.uint64(0xBF58476D1CE4E5B9)
+            h ^= h >> np.uint64(27)
+            h *= np.uint64(0x94D049BB133111EB)
+            h ^= h >> np.uint64(31)
+            keys[:, band] = h
+    return keys
+
+def build_band_buckets(sig_matrix: np.ndarray, bands: int, rows: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Per band, sorted bucket keys and the item ids in that order, both shape (bands, n_items)."""
+    keys = band_keys(sig_matrix, bands, rows).T
+    order = np.argsort(keys, axis=1, kind="stable").astype(np.int32)
+    keys_sorted = np.take_along_axis(keys, order, axis=1)
+    return np.ascontiguousarray(keys_sorted), np.ascontiguousarray(order)
+
+HASHERS = {"classic": MinHasher, "oph": OnePermMinHasher}
+
+def probe_keys(sig_matrix: np.ndarray, runner_up: np.ndarray, bands: int, rows: int,
+               probes: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Extra (query, band, key) bucket probes for multi-probe LSH.
+
+    For each query the `probes` rows with the smallest gap between the runner-up
+    and minimum hash value are perturbed one at a time (min -> runner-up), and the
+    key of the band containing that row is returned.
+    """
+    sig_matrix = np.atleast_2d(sig_matrix)
+    runner_up = np.atleast_2d(runner_up)
+    n_queries, n_hashes = sig_matrix.shape[0], bands * rows
+    probes = min(probes, n_hashes)
+    empty = np.zeros(0, dtype=np.int64)
+    if probes <= 0 or n_queries == 0:
+        return empty, empty, empty.astype(np.uint64)
+    gaps = np.where(runner_up[:, :n_hashes] >= 0, runner_up[:, :n_hashes] - sig_matrix[:, :n_hashes], np.inf)
+    cols = np.argpartition(gaps, probes - 1, axis=1)[:, :probes] if probes < n_hashes else np.tile(np.arange(n_hashes), (n_queries, 1))
+    q_idx = np.repeat(np.arange(n_queries), probes)
+    cols = cols.ravel()
+    valid = np.isfinite(gaps[q_idx, cols])
+    q_idx, cols = q_idx[valid], cols[valid]
+    perturbed = sig_matrix[q_idx, :n_hashes].copy()
+    perturbed[np.arange(len(q_idx)), cols] = runner_up[q_idx, cols]
+    band = cols // rows
+    keys = band_keys(perturbed, bands, rows)[np.arange(len(q_idx)), band]
+    return q_idx, band, keys
+
 def jaccard_from_sigs(sig1: np.ndarray, sig2: np.ndarray) -> float:
     return float(np.mean(sig1 == sig2))
 
@@ -40,24 +321,216 @@ class LSH:
         self.b = bands
         self.r = rows
 
+    @instrument.timed("lsh_index")
     def index(self, signatures: Dict[str, np.ndarray]) -> Dict[Tuple[int, int], List[str]]:
         # key: (band, bucket) -> list of ids
         buckets: DefaultDict[Tuple[int,int], List[str]] = defaultdict(list)
-        for pid, sig in signatures.items():
-            for band in range(self.b):
-                start = band * self.r
-                end = start + self.r
-                band_slice = tuple(sig[start:end].tolist())
-                bucket = hash(band_slice)
+        if not signatures:
+            return buckets
+        pids = list(signatures.keys())
+        keys = band_keys(np.stack([signatures[pid] for pid in pids]), self.b, self.r).tolist()
+        for pid, pid_keys in zip(pids, keys):
+            for band, bucket in enumerate(pid_keys):
                 buckets[(band, bucket)].append(pid)
+        if instrument.is_enabled():
+            instrument.observe("bucket_size", [len(ids) for ids in buckets.values()])
         return buckets
 
-    def query_candidates(self, sig: np.ndarray, buckets_index: Dict[Tuple[int,int], List[str]]) -> Set[str]:
+    @instrument.timed("lsh_query")
+    def query_candidates(self, sig: np.ndarray, buckets_index: Dict[Tuple[int,int], List[str]],
+                         probes: int = 0, runner_up: Optional[np.ndarray] = None) -> Set[str]:
         cands: Set[str] = set()
-        for band in range(self.b):
-            start = band * self.r
-            end = start + self.r
-            band_slice = tuple(sig[start:end].tolist())
-            bucket = hash(band_slice)
+        for band, bucket in enumerate(band_keys(sig, self.b, self.r)[0].tolist()):
             cands.update(buckets_index.get((band, bucket), []))
+        if probes > 0 and runner_up is not None:
+            # multi-probe: also visit the neighbouring buckets from probe_keys
+            _, bands, keys = probe_keys(sig, runner_up, self.b, self.r, probes)
+            for band, bucket in zip(bands.tolist(), keys.tolist()):
+                cands.update(buckets_index.get((band, bucket), []))
+        instrument.count("queries")
+        instrument.observe("candidates_per_query", len(cands))
         return cands
+
+class ArrayLSH:
+    """LSH over int32 item ids (rows of a signature matrix) backed by flat arrays.
+
+    Each band keeps its bucket keys sorted (uint64) together with the item ids in
+    the same order, so a bucket is a contiguous slice found with searchsorted.
+    Candidate semantics match `LSH`: the union of all items sharing a bucket with
+    the query in at least one band (the query itself included).
+
+    Hot-bucket protection: buckets larger than `max_bucket` (0 = no limit) are
+    either sampled down to `max_bucket` evenly spaced members ("sample") or ignored
+    ("skip") at query time, so a query returns at most bands * max_bucket ids from
+    the bands. Degenerate items (e.g. empty descriptions, see `set_degenerate`) are
+    kept out of the band arrays and only match each other on an exact signature.
+    """
+
+    def __init__(self, bands: int, rows: int, max_bucket: int = 0, bucket_policy: str = "sample"):
+        assert bands > 0 and rows > 0
+        assert bucket_policy in ("sample", "skip")
+        self.b = bands
+        self.r = rows
+        self.max_bucket = max_bucket
+        self.bucket_policy = bucket_policy
+        self.n_items = 0
+        self.keys_sorted: Optional[np.ndarray] = None  # (b, n_indexed) uint64
+        self.order: Optional[np.ndarray] = None  # (b, n_indexed) int32
+        self.degenerate_keys = np.zeros(0, dtype=np.uint64)  # sorted full-signature keys
+        self.degenerate_ids = np.zeros(0, dtype=np.int32)
+
+    @classmethod
+    def from_buckets(cls, bands: int, rows: int, keys_sorted: np.ndarray, order: np.ndarray,
+                     **kwargs) -> "ArrayLSH":
+        lsh = cls(bands, rows, **kwargs)
+        lsh.keys_sorted = keys_sorted
+        lsh.order = order
+        lsh.n_items = order.shape[1]
+        return lsh
+
+    @instrument.timed("lsh_index")
+    def index(self, sig_matrix: np.ndarray, degenerate: Optional[np.ndarray] = None) -> "ArrayLSH":
+        self.keys_sorted, self.order = build_band_buckets(sig_matrix, self.b, self.r)
+        self.n_items = len(sig_matrix)
+        if degenerate is not None:
+            self.set_degenerate(sig_matrix, degenerate)
+        if instrument.is_enabled():
+            instrument.observe("bucket_size", self._bucket_sizes())
+        return self
+
+    def set_degenerate(self, sig_matrix: np.ndarray, degenerate: np.ndarray) -> "ArrayLSH":
+        """Move the items flagged in `degenerate` out of the bands into an exact-match table."""
+        degenerate = np.asarray(degenerate, dtype=bool)
+        ids = np.flatnonzero(degenerate).astype(np.int32)
+        if len(ids) == 0:
+            return self
+        keep = ~degenerate[self.order]
+        n_keep = int(keep[0].sum())
+        self.order = self.order[keep].reshape(self.b, n_keep)
+        self.keys_sorted = self.keys_sorted[keep].reshape(self.b, n_keep)
+        keys = band_keys(np.asarray(sig_matrix)[ids], 1, sig_matrix.shape[1])[:, 0]
+        by_key = np.argsort(keys, kind="stable")
+        self.degenerate_keys, self.degenerate_ids = keys[by_key], ids[by_key]
+        return self
+
+    def _bucket_sizes(self) -> np.ndarray:
+        sizes = []
+        for band in range(self.b):
+            keys = self.keys_sorted[band]
+            if len(keys):
+                starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+                sizes.append(np.diff(np.r_[starts, len(keys)]))
+        return np.concatenate(sizes) if sizes else np.zeros(0, dtype=np.int64)
+
+    def bucket_stats(self) -> Dict[str, object]:
+        """Bucket-size distribution over all bands plus degenerate-item counts."""
+        sizes = self._bucket_sizes()
+        hist = np.bincount(np.log2(np.maximum(sizes, 1)).astype(np.int64)) if len(sizes) else np.zeros(0)
+        return {
+            "n_buckets": int(len(sizes)),
+            "max_bucket": int(sizes.max()) if len(sizes) else 0,
+            "p99_bucket": float(np.percentile(sizes, 99)) if len(sizes) else 0.0,
+            "mean_bucket": float(sizes.mean()) if len(sizes) else 0.0,
+            "log2_size_histogram": hist.tolist(),  # bin i counts buckets of size [2^i, 2^(i+1))
+            "buckets_over_cap": int((sizes > self.max_bucket).sum()) if self.max_bucket else 0,
+            "n_degenerate": int(len(self.degenerate_ids)),
+            "max_candidates_per_query": self.max_candidates(),
+        }
+
+    def max_candidates(self, probes: int = 0) -> Optional[int]:
+        """Worst-case candidate count per query with `probes` multi-probe lookups (None when uncapped).
+
+        Every band and every probe visits one bucket of at most max_bucket members,
+        and the exact-match table of degenerate items adds at most one more.
+        """
+        if not self.max_bucket:
+            return None
+        probes = min(max(probes, 0), self.b * self.r)
+        return (self.b + probes) * self.max_bucket + min(self.max_bucket, len(self.degenerate_ids))
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.keys_sorted.nbytes + self.order.nbytes
+                   + self.degenerate_keys.nbytes + self.degenerate_ids.nbytes)
+
+    def query_candidates(self, sig: np.ndarray, probes: int = 0, runner_up: Optional[np.ndarray] = None) -> np.ndarray:
+        if runner_up is not None:
+            runner_up = np.asarray(runner_up).reshape(1, -1)
+        _, ids = self.query_many(np.asarray(sig).reshape(1, -1), probes=probes, runner_up=runner_up)
+        return ids
+
+    @instrument.timed("lsh_query")
+    def query_many(self, sig_matrix: np.ndarray, batch_size: int = 4096, probes: int = 0,
+                   runner_up: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Candidates for every row of `sig_matrix` as CSR (offsets, ids).
+
+        Query i owns the sorted, de-duplicated ids[offsets[i]:offsets[i+1]].
+        With `probes` > 0 and the queries' `runner_up` values (MinHasher.runner_up_matrix),
+        up to `probes` extra neighbouring buckets are visited per query.
+        """
+        sig_matrix = np.atleast_2d(sig_matrix)
+        n_queries = sig_matrix.shape[0]
+        offsets = np.zeros(n_queries + 1, dtype=np.int64)
+        parts: List[np.ndarray] = []
+        for lo in range(0, n_queries, batch_size):
+            hi = min(lo + batch_size, n_queries)
+            ru = runner_up[lo:hi] if (probes > 0 and runner_up is not None) else None
+            q_idx, ids = self._query_batch(sig_matrix[lo:hi], ru, probes)
+            offsets[lo+1:hi+1] = offsets[lo] + np.cumsum(np.bincount(q_idx, minlength=hi - lo))
+            parts.append(ids)
+        ids = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+        instrument.count("queries", n_queries)
+        instrument.observe("candidates_per_query", np.diff(offsets))
+        return offsets, ids
+
+    def _query_batch(self, sig_matrix: np.ndarray, runner_up: Optional[np.ndarray] = None,
+                     probes: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        n_queries = sig_matrix.shape[0]
+        n_items = np.int64(max(self.n_items, 1))
+        keys = band_keys(sig_matrix, self.b, self.r)
+        if runner_up is not None and probes > 0:
+            probe_q, probe_band, probe_key = probe_keys(sig_matrix, runner_up, self.b, self.r, probes)
+        else:
+            probe_q = probe_band = None
+        codes = []
+        for band in range(self.b):
+            owners = np.arange(n_queries, dtype=np.int64)
+            band_key = keys[:, band]
+            if probe_q is not None:
+                sel = probe_band == band
+                owners = np.concatenate([owners, probe_q[sel]])
+                band_key = np.concatenate([band_key, probe_key[sel]])
+            idx, ids = self._lookup(self.keys_sorted[band], self.order[band], band_key)
+            codes.append(owners[idx] * n_items + ids)
+        if len(self.degenerate_ids):
+            full = band_keys(sig_matrix, 1, sig_matrix.shape[1])[:, 0]
+            idx, ids = self._lookup(self.degenerate_keys, self.degenerate_ids, full)
+            codes.append(idx * n_items + ids)
+        # one (query, item) code per hit; unique() merges hits from several bands
+        codes = np.unique(np.concatenate(codes)) if codes else np.zeros(0, dtype=np.int64)
+        return codes // n_items, (codes % n_items).astype(np.int32)
+
+    def _lookup(self, keys_sorted: np.ndarray, ids: np.ndarray, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # (query index, item id) for every bucket member, honouring the bucket cap
+        lo = np.searchsorted(keys_sorted, keys, side="left")
+        hi = np.searchsorted(keys_sorted, keys, side="right")
+        if self.max_bucket and self.bucket_policy == "skip":
+            hi = np.where(hi - lo > self.max_bucket, lo, hi)
+        if not self.max_bucket or self.bucket_policy == "skip":
+            owner, pos = _expand_ranges(lo, hi)
+            return owner, ids[pos]
+        sizes = hi - lo
+        take = np.minimum(sizes, self.max_bucket)
+        owner, k = _expand_ranges(np.zeros_like(take), take)
+        # evenly spaced members of an oversized bucket; identity for small buckets
+        pos = lo[owner] + (k * sizes[owner]) // np.maximum(take[owner], 1)
+        return owner, ids[pos]
+
+def _expand_ranges(lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # For ranges [lo[i], hi[i]) return (i repeated, position) for every covered position
+    counts = (hi - lo).astype(np.int64)
+    total = int(counts.sum())
+    owner = np.repeat(np.arange(len(lo), dtype=np.int64), counts)
+    starts = np.cumsum(counts) - counts
+    pos = np.arange(total, dtype=np.int64) - np.repeat(starts - lo, counts)
+    return owner, pos
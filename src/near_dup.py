@@ -0,0 +1,215 @@
+import argparse
+import csv
+import glob
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from data_loader import load_products
+from minhash_lsh import MinHasher
+from shingling import degenerate_mask
+from signature_store import SignatureStore, open_signatures
+from text_clean import build_text
+
+
+def _positions(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # positions s .. e-2 of every bucket, with the end of the bucket each belongs to
+    counts = ends - starts - 1
+    end_of = np.repeat(ends, counts)
+    pos = np.arange(int(counts.sum()), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+    return pos, end_of
+
+
+def _bucket_pairs(order: np.ndarray, keys: np.ndarray, max_bucket: int, max_pairs: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """All (i, j) id pairs sharing a bucket in one band, yielded in chunks of about max_pairs."""
+    n = len(keys)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], n]
+    sizes = ends - starts
+    ok = (sizes >= 2) & (sizes <= max_bucket) if max_bucket > 0 else sizes >= 2
+    starts, ends = starts[ok], ends[ok]
+    # every position p of a bucket [s, e) pairs with positions p+1 .. e-1
+    pos, end_of = _positions(starts, ends)
+    counts = end_of - pos - 1
+    cum = np.cumsum(counts)
+    lo = 0
+    while lo < len(pos):
+        hi = int(np.searchsorted(cum, (cum[lo - 1] if lo else 0) + max_pairs, side="right"))
+        hi = max(hi, lo + 1)
+        c = counts[lo:hi]
+        first = np.repeat(pos[lo:hi], c)
+        second = first + 1 + (np.arange(int(c.sum())) - np.repeat(np.cumsum(c) - c, c))
+        yield order[first], order[second]
+        lo = hi
+
+
+def emit_band_pairs(store_path: tuple, bands: List[int], b: int, r: int, threshold: float,
+                    n_partitions: int, max_bucket: int, spill_dir: str, max_pairs: int = 1 << 22,
+                    degenerate: Optional[np.ndarray] = None) -> int:
+    """Spill candidate pairs of the given bands that pass the MinHash threshold.
+
+    Pairs are encoded as i * n + j (i < j), de-duplicated per chunk and appended to
+    one spill file per partition (i % n_partitions) so the merge step only ever
+    holds one partition in memory. Items flagged in `degenerate` are dropped from
+    the buckets before pairing. Returns the number of pairs written.
+    """
+    store = SignatureStore(*store_path)
+    _, sigs = store.load()
+    keys_sorted, order = store.load_bands(b, r)
+    n = np.int64(sigs.shape[0])
+    written = 0
+    files = [open(os.path.join(spill_dir, f"part{p:04d}_band{bands[0]:04d}.bin"), "ab") for p in range(n_partitions)]
+    try:
+        for band in bands:
+            ids, keys = np.asarray(order[band]), np.asarray(keys_sorted[band])
+            if degenerate is not None:
+                keep = ~degenerate[ids]
+                ids, keys = ids[keep], keys[keep]
+            for i, j in _bucket_pairs(ids, keys, max_bucket, max_pairs):
+                i, j = np.minimum(i, j).astype(np.int64), np.maximum(i, j).astype(np.int64)
+                codes = np.unique(i * n + j)
+                i, j = codes // n, codes % n
+                sims = (sigs[i] == sigs[j]).mean(axis=1)
+                codes = codes[sims >= threshold]
+                part = (codes // n) % n_partitions
+                for p in range(n_partitions):
+                    chunk = codes[part == p]
+                    chunk.tofile(files[p])
+                    written += len(chunk)
+    finally:
+        for f in files:
+            f.close()
+    return written
+
+
+class UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]  # path halving
+            x = parent[x]
+        return x
+
+    def union(self, a: int, b: int) -> None:
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            if ra < rb:
+                ra, rb = rb, ra
+            self.parent[ra] = rb
+
+
+def find_near_duplicates(asins: List[str], store: SignatureStore, b: int, r: int, threshold: float, out_dir: str,
+                         n_partitions: int = 16, n_jobs: int = 1, max_bucket: int = 1000,
+                         degenerate: Optional[np.ndarray] = None) -> Tuple[int, int]:
+    """Write pairs.csv (asin_a, asin_b, similarity) and clusters.csv (cluster, asin) under out_dir.
+
+    Items flagged in `degenerate` (shingling.degenerate_mask: empty or too-short
+    texts, which all share the same signature) are kept out of the join and listed
+    in degenerate.csv instead. Buckets larger than `max_bucket` are skipped (0 = no
+    limit). Returns (number of pairs, number of clusters with at least two members).
+    """
+    spill_dir = os.path.join(out_dir, "spill")
+    shutil.rmtree(spill_dir, ignore_errors=True)
+    os.makedirs(spill_dir)
+    store.bands(b, r)  # make sure band buckets exist before workers memory-map them
+    store_path = (store.root, store.mode, store.K, store.num_hashes, store.seed)
+    groups = [list(g) for g in np.array_split(np.arange(b), max(1, min(n_jobs, b))) if len(g)]
+    if degenerate is not None:
+        degenerate = np.asarray(degenerate, dtype=bool)
+        with open(os.path.join(out_dir, "degenerate.csv"), "w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["asin"])
+            w.writerows([asins[i]] for i in np.flatnonzero(degenerate))
+    args = [(store_path, [int(x) for x in g], b, r, threshold, n_partitions, max_bucket, spill_dir, 1 << 22, degenerate)
+            for g in groups]
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            list(pool.map(emit_band_pairs, *zip(*args)))
+    else:
+        for a in args:
+            emit_band_pairs(*a)
+
+    _, sigs = store.load()
+    n = np.int64(len(asins))
+    uf = UnionFind(len(asins))
+    n_pairs = 0
+    with open(os.path.join(out_dir, "pairs.csv"), "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["asin_a", "asin_b", "similarity"])
+        for p in range(n_partitions):
+            files = glob.glob(os.path.join(spill_dir, f"part{p:04d}_*.bin"))
+            if not files:
+                continue
+            # pairs colliding in several bands appear once after this
+            codes = np.unique(np.concatenate([np.fromfile(fn, dtype=np.int64) for fn in files]))
+            i, j = codes // n, codes % n
+            sims = (sigs[i] == sigs[j]).mean(axis=1)
+            for a, c, s in zip(i.tolist(), j.tolist(), sims.tolist()):
+                w.writerow([asins[a], asins[c], f"{s:.4f}"])
+                uf.union(a, c)
+            n_pairs += len(codes)
+    shutil.rmtree(spill_dir, ignore_errors=True)
+
+    members = {}
+    for x in range(len(asins)):
+        members.setdefault(uf.find(x), []).append(x)
+    groups_out = sorted((m for m in members.values() if len(m) > 1), key=len, reverse=True)
+    with open(os.path.join(out_dir, "clusters.csv"), "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["cluster", "asin"])
+        for cid, members in enumerate(groups_out):
+            for m in members:
+                w.writerow([cid, asins[m]])
+    return n_pairs, len(groups_out)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="All-pairs near-duplicate join and clustering")
+    ap.add_argument("--data", required=True, help="path to meta_Appliances.json.gz")
+    ap.add_argument("--mode", choices=["PST","PSD","PSTD"], default="PSTD")
+    ap.add_argument("--K", type=int, default=5)
+    ap.add_argument("--num_hashes", type=int, default=100)
+    ap.add_argument("--b", type=int, default=20)
+    ap.add_argument("--r", type=int, default=5)
+    ap.add_argument("--threshold", type=float, default=0.8, help="minimum MinHash-Jaccard for a pair")
+    ap.add_argument("--store_dir", default=None, help="signature store (default: <out_dir>/store)")
+    ap.add_argument("--out_dir", default="reports/near_dup")
+    ap.add_argument("--n_jobs", type=int, default=1, help="processes over band partitions")
+    ap.add_argument("--n_partitions", type=int, default=16, help="on-disk pair partitions for the merge")
+    ap.add_argument("--max_bucket", type=int, default=1000, help="skip buckets larger than this (0 = no limit)")
+    ap.add_argument("--min_shingles", type=int, default=2,
+                    help="texts with fewer distinct shingles are left out of the join (degenerate.csv)")
+    args = ap.parse_args()
+    if args.b * args.r != args.num_hashes:
+        ap.error("b * r must equal num_hashes")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    products = load_products(args.data)
+    asins = list(products.keys())
+    store = SignatureStore(args.store_dir or os.path.join(args.out_dir, "store"), args.mode, args.K, args.num_hashes)
+
+    texts = [build_text(products[a], args.mode) for a in asins]
+
+    def build() -> np.ndarray:
+        mh = MinHasher(args.num_hashes)
+        values, offsets = mh.hash_texts(texts, args.K)
+        return mh.signature_matrix(values, offsets, n_jobs=args.n_jobs)
+
+    open_signatures(store, asins, texts, build)
+    degenerate = degenerate_mask(texts, args.K, args.min_shingles) if args.min_shingles > 0 else None
+    n_pairs, n_clusters = find_near_duplicates(asins, store, args.b, args.r, args.threshold, args.out_dir,
+                                               n_partitions=args.n_partitions, n_jobs=args.n_jobs,
+                                               max_bucket=args.max_bucket, degenerate=degenerate)
+    n_degenerate = int(degenerate.sum()) if degenerate is not None else 0
+    print(f"{n_pairs} pairs >= {args.threshold}, {n_clusters} clusters, {n_degenerate} degenerate texts skipped; "
+          f"saved to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
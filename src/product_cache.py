@@ -0,0 +1,159 @@
+import json
+import os
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from title_index import TitleIndex
+
+# Bump when the cached columns or the parsing rules that produce them change
+CACHE_VERSION = 2
+
+TEXT_FIELDS = ["title", "description", "norm_title", "norm_desc"]
+
+
+def _encode_column(values: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    # concatenated UTF-8 bytes + int64 offsets; value i is data[offsets[i]:offsets[i+1]]
+    encoded = [v.encode("utf-8", "surrogatepass") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _decode_column(data: np.ndarray, offsets: np.ndarray) -> List[str]:
+    raw = data.tobytes()
+    bounds = offsets.tolist()
+    return [raw[bounds[i]:bounds[i+1]].decode("utf-8", "surrogatepass") for i in range(len(bounds) - 1)]
+
+
+def _source_stamp(source: str) -> Dict[str, Any]:
+    st = os.stat(source)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "version": CACHE_VERSION}
+
+
+class ProductColumns:
+    """Memory-mapped columnar view of the products written by `write_product_cache`."""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.asins = self._load("asins.npy")
+        self.related = self._load("related.npy")
+        self.related_offsets = self._load("related_offsets.npy")
+        self._columns: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def _load(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.cache_dir, name), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.asins)
+
+    def title_index(self) -> TitleIndex:
+        """Trigram index over norm_title, memory-mapped like the columns it points into."""
+        return TitleIndex(self._load("title_grams.npy"), self._load("title_gram_offsets.npy"),
+                          self._load("title_postings.npy"), self._load("norm_title.npy"),
+                          self._load("norm_title_offsets.npy"))
+
+    def _column(self, field: str) -> Tuple[np.ndarray, np.ndarray]:
+        if field not in self._columns:
+            self._columns[field] = (self._load(f"{field}.npy"), self._load(f"{field}_offsets.npy"))
+        return self._columns[field]
+
+    def text(self, field: str) -> List[str]:
+        return _decode_column(*self._column(field))
+
+    def record(self, i: int) -> Dict[str, Any]:
+        """Product record of row i, decoded from the mapped columns."""
+        rec = {"asin": str(self.asins[i])}
+        for field in TEXT_FIELDS:
+            data, offsets = self._column(field)
+            rec[field] = data[offsets[i]:offsets[i+1]].tobytes().decode("utf-8", "surrogatepass")
+        rec["similar_item"] = self.related[self.related_offsets[i]:self.related_offsets[i+1]].tolist()
+        return rec
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Every record decoded into a plain dict (eager; LazyProducts decodes on access)."""
+        asins = self.asins.tolist()
+        texts = {field: self.text(field) for field in TEXT_FIELDS}
+        related = self.related.tolist()
+        bounds = self.related_offsets.tolist()
+        products = {}
+        for i, asin in enumerate(asins):
+            rec = {"asin": asin}
+            for field in TEXT_FIELDS:
+                rec[field] = texts[field][i]
+            rec["similar_item"] = related[bounds[i]:bounds[i+1]]
+            products[asin] = rec
+        return products
+
+
+class LazyProducts(Mapping):
+    """Read-only ASIN -> record mapping over ProductColumns.
+
+    Only the ASIN table is held in Python objects; each record is decoded from the
+    memory-mapped columns when it is looked up (and not kept), and `texts(field)`
+    decodes a whole column in one pass.
+    """
+
+    def __init__(self, columns: ProductColumns):
+        self.columns = columns
+        self._asins: List[str] = columns.asins.tolist()
+        self._row_of = {asin: i for i, asin in enumerate(self._asins)}
+
+    def __getitem__(self, asin: str) -> Dict[str, Any]:
+        return self.columns.record(self._row_of[asin])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._asins)
+
+    def __len__(self) -> int:
+        return len(self._asins)
+
+    def __contains__(self, asin: object) -> bool:
+        return asin in self._row_of
+
+    def texts(self, field: str) -> List[str]:
+        """One text field of every product, in ASIN order."""
+        return self.columns.text(field)
+
+
+def _save(cache_dir: str, name: str, arr: np.ndarray) -> None:
+    with open(os.path.join(cache_dir, name), "wb") as f:
+        np.save(f, arr)
+
+
+def write_product_cache(cache_dir: str, source: str, records: List[Dict[str, Any]]) -> None:
+    """Write parsed product records as numpy columns next to a stamp of the source file."""
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, "meta.json")
+    # invalidate first so a crash mid-write never leaves a valid-looking cache
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    _save(cache_dir, "asins.npy", np.array([r["asin"] for r in records], dtype=str))
+    for field in TEXT_FIELDS:
+        data, offsets = _encode_column([r[field] for r in records])
+        _save(cache_dir, f"{field}.npy", data)
+        _save(cache_dir, f"{field}_offsets.npy", offsets)
+    related = [a for r in records for a in r["similar_item"]]
+    offsets = np.zeros(len(records) + 1, dtype=np.int64)
+    np.cumsum([len(r["similar_item"]) for r in records], out=offsets[1:])
+    _save(cache_dir, "related.npy", np.array(related, dtype=str))
+    _save(cache_dir, "related_offsets.npy", offsets)
+    index = TitleIndex.build([r["norm_title"] for r in records]).arrays()
+    _save(cache_dir, "title_grams.npy", index["grams"])
+    _save(cache_dir, "title_gram_offsets.npy", index["offsets"])
+    _save(cache_dir, "title_postings.npy", index["postings"])
+    with open(meta_path, "w") as f:
+        json.dump({"source": _source_stamp(source), "n_products": len(records)}, f)
+
+
+def open_product_cache(cache_dir: str, source: str) -> Optional[ProductColumns]:
+    """Open the cache if it exists and was built from the current version of `source`."""
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get("source") != _source_stamp(source):
+        return None
+    return ProductColumns(cache_dir)
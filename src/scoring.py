@@ -0,0 +1,102 @@
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+import instrument
+from bbit import PackedSignatures
+
+
+def signature_scores(query_sig: np.ndarray, cand_ids: np.ndarray,
+                     sig_matrix: Union[np.ndarray, PackedSignatures]) -> np.ndarray:
+    """MinHash-Jaccard of the query against every candidate row, in one array operation.
+
+    With b-bit packed signatures the estimate is XOR/popcount based and bias-corrected.
+    """
+    if len(cand_ids) == 0:
+        return np.zeros(0, dtype=np.float64)
+    if isinstance(sig_matrix, (PackedSignatures, BlendedSignatures)):
+        return sig_matrix.scores(query_sig, cand_ids)
+    return (sig_matrix[cand_ids] == query_sig).mean(axis=1)
+
+
+class BlendedSignatures:
+    """Weighted sum of per-field MinHash-Jaccard scores, e.g. title and description.
+
+    Each part is a signature matrix (full-width or packed) over the same rows.
+    Row indexing returns one query row per part, so score_candidates works unchanged.
+    """
+
+    def __init__(self, parts: Sequence, weights: Sequence[float]):
+        self.parts = list(parts)
+        self.weights = list(weights)
+
+    def __len__(self) -> int:
+        return len(self.parts[0])
+
+    def __getitem__(self, rows) -> tuple:
+        return tuple(part[rows] for part in self.parts)
+
+    def scores(self, query_sig: tuple, cand_ids: np.ndarray) -> np.ndarray:
+        return sum(w * signature_scores(q, cand_ids, part)
+                   for q, part, w in zip(query_sig, self.parts, self.weights))
+
+
+def select_top_k(ids: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Best k (id, score) pairs by descending score, ties broken by ascending id.
+
+    Uses argpartition so only the survivors are sorted.
+    """
+    ids = np.asarray(ids)
+    scores = np.asarray(scores)
+    if k <= 0 or len(ids) == 0:
+        return ids[:0], scores[:0]
+    if len(ids) > k:
+        # keep every candidate tied with the k-th score so the tie-break stays exact
+        kth = -np.partition(-scores, k - 1)[k - 1]
+        keep = np.flatnonzero(scores >= kth)
+        ids, scores = ids[keep], scores[keep]
+    order = np.lexsort((ids, -scores))[:k]
+    return ids[order], scores[order]
+
+
+def sort_shingle_rows(values: np.ndarray, offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sort and de-duplicate every row of a CSR shingle-hash layout."""
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    order = np.lexsort((values, rows))
+    values, rows = values[order], rows[order]
+    keep = np.ones(len(values), dtype=bool)
+    keep[1:] = (values[1:] != values[:-1]) | (rows[1:] != rows[:-1])
+    values, rows = values[keep], rows[keep]
+    new_offsets = np.zeros(len(offsets), dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(offsets) - 1), out=new_offsets[1:])
+    return values, new_offsets
+
+
+def exact_jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    """Jaccard of two sorted, de-duplicated integer shingle arrays."""
+    if len(a) == 0 and len(b) == 0:
+        return 0.0
+    inter = len(np.intersect1d(a, b, assume_unique=True))
+    return inter / (len(a) + len(b) - inter)
+
+
+@instrument.timed("score_candidates")
+def score_candidates(query_row: int, cand_ids: np.ndarray, sig_matrix: Union[np.ndarray, PackedSignatures], top_k: int,
+                     shingles: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                     rerank_depth: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k candidate ids and scores for the item at `query_row`.
+
+    Candidates are scored by MinHash-Jaccard (full-width or b-bit packed). With `rerank_depth` > 0 and sorted
+    `shingles` (see sort_shingle_rows), the best `rerank_depth` of them are re-scored
+    by exact Jaccard before the final top-k cut.
+    """
+    cand_ids = cand_ids[cand_ids != query_row]
+    instrument.count("candidates_scored", len(cand_ids))
+    scores = signature_scores(sig_matrix[query_row], cand_ids, sig_matrix)
+    if rerank_depth <= 0 or shingles is None:
+        return select_top_k(cand_ids, scores, top_k)
+    ids, _ = select_top_k(cand_ids, scores, max(rerank_depth, top_k))
+    values, offsets = shingles
+    q = values[offsets[query_row]:offsets[query_row+1]]
+    exact = np.array([exact_jaccard(q, values[offsets[c]:offsets[c+1]]) for c in ids], dtype=np.float64)
+    return select_top_k(ids, exact, top_k)
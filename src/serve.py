@@ -0,0 +1,238 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from engine import MODE_FIELDS, SimilarityEngine
+
+
+class LatencyStats:
+    """Request latencies over a sliding window plus lifetime counters."""
+
+    def __init__(self, window: int = 10000):
+        self.latencies = deque(maxlen=window)
+        self.started = time.monotonic()
+        self.requests = 0
+        self.items = 0
+        self.batches = 0
+        self.batched_items = 0
+
+    def record(self, seconds: float, items: int = 1) -> None:
+        self.latencies.append(seconds)
+        self.requests += 1
+        self.items += items
+
+    def snapshot(self) -> Dict[str, float]:
+        uptime = time.monotonic() - self.started
+        lat = np.asarray(self.latencies, dtype=np.float64) * 1000.0
+        return {"requests": self.requests, "items": self.items, "uptime_s": uptime,
+                "throughput_rps": self.requests / uptime if uptime > 0 else 0.0,
+                "p50_ms": float(np.percentile(lat, 50)) if len(lat) else 0.0,
+                "p99_ms": float(np.percentile(lat, 99)) if len(lat) else 0.0,
+                "batches": self.batches,
+                "mean_batch_size": self.batched_items / self.batches if self.batches else 0.0}
+
+
+class QueryBatcher:
+    """Groups queries that arrive within `window` seconds into one engine.query_many call.
+
+    Queries are grouped per (mode, k); a group is flushed when its window expires or it
+    reaches `max_batch` items. The engine runs on a single worker thread, so the event
+    loop keeps accepting requests while a batch is scored.
+    """
+
+    def __init__(self, engine: SimilarityEngine, K: int, num_hashes: int, b: int, r: int,
+                 stats: LatencyStats, window: float = 0.005, max_batch: int = 256):
+        self.engine = engine
+        self.K, self.num_hashes, self.b, self.r = K, num_hashes, b, r
+        self.stats = stats
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[Tuple[str, int], List[Tuple[str, asyncio.Future]]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def submit(self, asin: str, mode: str, k: int) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        key = (mode, k)
+        group = self._pending.setdefault(key, [])
+        group.append((asin, fut))
+        if len(group) == 1:
+            loop.call_later(self.window, self._flush, key)
+        elif len(group) >= self.max_batch:
+            self._flush(key)
+        return fut
+
+    def _flush(self, key: Tuple[str, int]) -> None:
+        group = self._pending.pop(key, None)
+        if group:
+            asyncio.ensure_future(self._run(key, group))
+
+    async def _run(self, key: Tuple[str, int], group: List[Tuple[str, asyncio.Future]]) -> None:
+        mode, k = key
+        asins = [asin for asin, _ in group]
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                self._executor, lambda: self.engine.query_many(asins, mode, self.K, self.num_hashes,
+                                                               self.b, self.r, k))
+        except Exception as exc:
+            for _, fut in group:
+                if not fut.done():
+                    fut.set_exception(exc)
+            return
+        self.stats.batches += 1
+        self.stats.batched_items += len(group)
+        for (_, fut), res in zip(group, results):
+            if not fut.done():
+                fut.set_result(res)
+
+    def warm(self, modes: List[str]) -> None:
+        """Build (or memory-map) signatures and band indexes before accepting traffic."""
+        for mode in modes:
+            self.engine.bands(mode, self.K, self.num_hashes, self.b, self.r)
+
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+
+def _results_json(pairs: List[Tuple[str, float]]) -> List[Dict[str, object]]:
+    return [{"asin": asin, "score": score} for asin, score in pairs]
+
+
+class SimilarityServer:
+    """Minimal HTTP/1.1 front end (keep-alive, JSON responses) over a QueryBatcher.
+
+    GET  /similar?asin=&k=&mode=          top-k neighbours of one product
+    POST /similar/bulk  {"asins": [...], "k": 10, "mode": "PSTD"}
+    GET  /stats                           latency percentiles, throughput, batch sizes
+    """
+
+    def __init__(self, batcher: QueryBatcher, stats: LatencyStats, default_mode: str = "PSTD", max_k: int = 100):
+        self.batcher = batcher
+        self.stats = stats
+        self.default_mode = default_mode
+        self.max_k = max_k
+
+    def _params(self, mode: Optional[str], k: Optional[str]) -> Tuple[str, int]:
+        mode = mode or self.default_mode
+        if mode not in MODE_FIELDS:
+            raise ValueError(f"unknown mode {mode!r}")
+        k = int(k) if k else 10
+        if not 1 <= k <= self.max_k:
+            raise ValueError(f"k must be in 1..{self.max_k}")
+        return mode, k
+
+    async def route(self, method: str, target: str, body: bytes) -> Tuple[int, object, int]:
+        """(status, JSON payload, number of products queried)."""
+        url = urlsplit(target)
+        query = {key: vals[-1] for key, vals in parse_qs(url.query).items()}
+        row_of = self.batcher.engine.row_of
+        if method == "GET" and url.path == "/stats":
+            return 200, self.stats.snapshot(), 0
+        if method == "GET" and url.path == "/similar":
+            mode, k = self._params(query.get("mode"), query.get("k"))
+            asin = query.get("asin", "")
+            if asin not in row_of:
+                return 404, {"error": f"unknown asin {asin!r}"}, 0
+            res = await self.batcher.submit(asin, mode, k)
+            return 200, {"asin": asin, "mode": mode, "k": k, "results": _results_json(res)}, 1
+        if method == "POST" and url.path == "/similar/bulk":
+            req = json.loads(body or b"{}")
+            if not isinstance(req, dict):
+                raise ValueError("request body must be a JSON object")
+            mode, k = self._params(req.get("mode"), str(req.get("k", "")))
+            asins = [a for a in req.get("asins", []) if a in row_of]
+            found = await asyncio.gather(*(self.batcher.submit(a, mode, k) for a in asins))
+            results = {a: None for a in req.get("asins", [])}
+            results.update({a: _results_json(res) for a, res in zip(asins, found)})
+            return 200, {"mode": mode, "k": k, "results": results}, len(asins)
+        return 404, {"error": f"no route for {method} {url.path}"}, 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                method, target, _ = line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = h.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                t = time.perf_counter()
+                try:
+                    status, payload, items = await self.route(method, target, body)
+                except ValueError as exc:
+                    status, payload, items = 400, {"error": str(exc)}, 0
+                except Exception as exc:
+                    # engine failures and malformed (non-object) JSON bodies still get an answer
+                    status, payload, items = 500, {"error": f"{type(exc).__name__}: {exc}"}, 0
+                data = json.dumps(payload).encode()
+                close = headers.get("connection", "").lower() == "close"
+                writer.write(f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                             f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if urlsplit(target).path != "/stats":
+                    self.stats.record(time.perf_counter() - t, items)
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(engine: SimilarityEngine, host: str, port: int, K: int, num_hashes: int, b: int, r: int,
+                modes: List[str], window: float = 0.005, max_batch: int = 256) -> None:
+    stats = LatencyStats()
+    batcher = QueryBatcher(engine, K, num_hashes, b, r, stats, window=window, max_batch=max_batch)
+    batcher.warm(modes)
+    server = SimilarityServer(batcher, stats, default_mode=modes[0])
+    srv = await asyncio.start_server(server.handle, host, port)
+    print(f"Serving {len(engine.asins)} products on http://{host}:{port} (modes {', '.join(modes)})")
+    async with srv:
+        await srv.serve_forever()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local similar-products query service")
+    ap.add_argument("--data", required=True, help="path to meta_Appliances.json.gz")
+    ap.add_argument("--store_dir", default=None, help="prebuilt signature store (built and saved if missing)")
+    ap.add_argument("--modes", nargs="+", choices=["PST","PSD","PSTD"], default=["PSTD"],
+                    help="modes to preload; the first is the default")
+    ap.add_argument("--K", type=int, default=5)
+    ap.add_argument("--num_hashes", type=int, default=100)
+    ap.add_argument("--b", type=int, default=20)
+    ap.add_argument("--r", type=int, default=5)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--window_ms", type=float, default=5.0, help="batching window for concurrent requests")
+    ap.add_argument("--max_batch", type=int, default=256, help="flush a batch early at this many queries")
+    ap.add_argument("--cache_size", type=int, default=10000, help="LRU result cache entries")
+    args = ap.parse_args()
+
+    if args.b * args.r != args.num_hashes:
+        ap.error("b * r must equal num_hashes")
+    engine = SimilarityEngine(args.store_dir, max_queries=args.cache_size)
+    engine.load(args.data)
+    try:
+        asyncio.run(serve(engine, args.host, args.port, args.K, args.num_hashes, args.b, args.r, args.modes,
+                          window=args.window_ms / 1000.0, max_batch=args.max_batch))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
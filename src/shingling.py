@@ -1,4 +1,9 @@
-from typing import Set
+from typing import Iterable, List, Set, Tuple
+
+import numpy as np
+
+import instrument
+from text_clean import normalize_bytes
 
 def char_k_shingles(s: str, k: int) -> Set[str]:
     if not s:
@@ -7,3 +12,135 @@ def char_k_shingles(s: str, k: int) -> Set[str]:
     if len(s) < k:
         return {s}
     return { s[i:i+k] for i in range(len(s)-k+1) }
+
+def degenerate_mask(texts: List[str], k: int, min_shingles: int = 2) -> np.ndarray:
+    # True where a text is too short to yield min_shingles distinct k-shingles
+    # (empty texts and texts shorter than k give at most one shingle)
+    return np.array([not t or len(t) + 2 - k + 1 < min_shingles for t in texts], dtype=bool)
+
+# Shingle hashing shared by the string and the byte-array paths: a polynomial
+# over the UTF-8 bytes followed by a splitmix64 finalizer, all mod 2**64.
+_MASK64 = (1 << 64) - 1
+_POLY = 0x100000001B3
+
+def _mix64(h: int) -> int:
+    h ^= h >> 30
+    h = (h * 0xBF58476D1CE4E5B9) & _MASK64
+    h ^= h >> 27
+    h = (h * 0x94D049BB133111EB) & _MASK64
+    return h ^ (h >> 31)
+
+def hash_bytes(data: bytes) -> int:
+    """64-bit hash of one shingle; equals the value the array path emits for it."""
+    h = 0
+    for c in data:
+        h = (h * _POLY + c + 1) & _MASK64
+    return _mix64(h)
+
+def _mix64_array(h: np.ndarray) -> np.ndarray:
+    h = h ^ (h >> np.uint64(30))
+    h = h * np.uint64(0xBF58476D1CE4E5B9)
+    h = h ^ (h >> np.uint64(27))
+    h = h * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+@instrument.timed("shingle_hashes")
+def batch_shingle_hashes(texts: Iterable[str], k: int, chunk_bytes: int = 1 << 20) -> Tuple[np.ndarray, np.ndarray]:
+    """Distinct k-shingle hashes of many texts as CSR (uint64 values, int64 offsets).
+
+    Row i is the set {hash_bytes(x.encode()) for x in char_k_shingles(texts[i], k)},
+    computed with a vectorized rolling hash over a concatenated byte buffer
+    instead of materializing the shingle strings. Non-ASCII texts (where byte and
+    character k-grams differ) fall back to the string path. Texts are processed in
+    runs of about `chunk_bytes` characters, so the temporaries (roughly 65 bytes
+    per text byte) stay bounded however large the catalog is.
+    """
+    texts = list(texts)
+    n = len(texts)
+    parts: List[np.ndarray] = []
+    counts = np.zeros(n, dtype=np.int64)
+    lo = 0
+    while lo < n:
+        hi, size = lo + 1, len(texts[lo])
+        while hi < n and size + len(texts[hi]) <= chunk_bytes:
+            size += len(texts[hi])
+            hi += 1
+        vals, counts[lo:hi] = _shingle_chunk(texts[lo:hi], k)
+        parts.append(vals)
+        lo = hi
+    vals = np.concatenate(parts) if parts else np.zeros(0, dtype=np.uint64)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    instrument.count("texts_shingled", n)
+    instrument.observe("shingles_per_text", counts)
+    return vals, offsets
+
+def _shingle_chunk(texts: List[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # (distinct hashes of every text, in text order; count per text)
+    n = len(texts)
+    chunks: List[bytes] = []
+    starts = np.zeros(n, dtype=np.int64)
+    lengths = np.zeros(n, dtype=np.int64)
+    extra_rows: List[int] = []
+    extra_vals: List[np.ndarray] = []
+    pos = 0
+    for i, t in enumerate(texts):
+        if not t:
+            continue
+        if not t.isascii() or len(t) + 2 < k:
+            # whole-string shingle or multi-byte characters: hash the string shingles directly
+            vals = np.array([hash_bytes(x.encode("utf-8")) for x in char_k_shingles(t, k)], dtype=np.uint64)
+            extra_rows.append(i)
+            extra_vals.append(vals)
+            continue
+        data = b"^" + t.encode("ascii") + b"$"
+        chunks.append(data)
+        starts[i] = pos
+        lengths[i] = len(data)
+        pos += len(data)
+
+    buf = np.frombuffer(b"".join(chunks), dtype=np.uint8).astype(np.uint64)
+    n_grams = max(len(buf) - k + 1, 0)
+    h = np.zeros(n_grams, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for j in range(k):
+            h = h * np.uint64(_POLY) + buf[j:j + n_grams] + np.uint64(1)
+        h = _mix64_array(h)
+
+    # keep grams that start inside a text and end before the text does
+    per_text = np.maximum(lengths - k + 1, 0)
+    doc = np.repeat(np.arange(n, dtype=np.int64), per_text)
+    gram_pos = np.arange(int(per_text.sum()), dtype=np.int64) - np.repeat(np.cumsum(per_text) - per_text - starts, per_text)
+    vals = h[gram_pos]
+    if extra_rows:
+        doc = np.concatenate([doc] + [np.full(len(v), i, dtype=np.int64) for i, v in zip(extra_rows, extra_vals)])
+        vals = np.concatenate([vals] + extra_vals)
+
+    # de-duplicate within each text
+    order = np.lexsort((vals, doc))
+    doc, vals = doc[order], vals[order]
+    keep = np.ones(len(vals), dtype=bool)
+    keep[1:] = (vals[1:] != vals[:-1]) | (doc[1:] != doc[:-1])
+    doc, vals = doc[keep], vals[keep]
+    return vals, np.bincount(doc, minlength=n)
+
+def char_k_shingle_hashes(s: str, k: int) -> np.ndarray:
+    """Sorted distinct uint64 hashes of char_k_shingles(s, k)."""
+    return batch_shingle_hashes([s], k)[0]
+
+def normalize_and_shingle(raw: str, k: int) -> np.ndarray:
+    """Fused normalize_text + char_k_shingle_hashes working on encoded bytes."""
+    return char_k_shingle_hashes(normalize_bytes(raw).decode("ascii"), k)
+
+def union_rows(a: Tuple[np.ndarray, np.ndarray], b: Tuple[np.ndarray, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Row-wise concatenation of two CSR hash layouts (row i = a's row i + b's row i).
+
+    Duplicates are kept; MinHash ignores them and sort_shingle_rows drops them.
+    """
+    (a_vals, a_off), (b_vals, b_off) = a, b
+    n = len(a_off) - 1
+    rows = np.concatenate([np.repeat(np.arange(n), np.diff(a_off)), np.repeat(np.arange(n), np.diff(b_off))])
+    order = np.argsort(rows, kind="stable")
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.diff(a_off) + np.diff(b_off), out=offsets[1:])
+    return np.concatenate([a_vals, b_vals])[order], offsets
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from bbit import PackedSignatures, pack_bbit
+from minhash_lsh import HASH_VERSION, build_band_buckets
+
+
+class SignatureStore:
+    """On-disk MinHash signatures and LSH band buckets for one (mode, K, num_hashes, seed, hasher).
+
+    Layout under `root/<key>/`:
+      asins.npy                 fixed-width unicode id table, row i <-> signature row i
+      signatures.npy            int64 matrix (n_items, num_hashes)
+      signatures_b{bits}.npy    uint64 b-bit packed copy of the signatures (see bbit.py)
+      bands_b{b}_r{r}_keys.npy  uint64 (b, n_items) sorted bucket keys per band
+      bands_b{b}_r{r}_order.npy int32 (b, n_items) item ids in key order
+    Arrays are reopened with mmap_mode='r', so loads are near-instant and the pages
+    are shared between processes through the OS page cache. meta.json records a
+    digest of the signed texts (`texts_digest`) so edited products are re-signed.
+    """
+
+    def __init__(self, root: str, mode: str, K: int, num_hashes: int, seed: int = 42, hasher: str = "classic"):
+        self.root = root
+        self.mode = mode
+        self.K = K
+        self.num_hashes = num_hashes
+        self.seed = seed
+        self.hasher = hasher
+        suffix = "" if hasher == "classic" else f"_{hasher}"
+        self.path = os.path.join(root, f"{mode}_K{K}_H{num_hashes}_seed{seed}_v{HASH_VERSION}{suffix}")
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _save_array(self, name: str, arr: np.ndarray) -> None:
+        # write then rename so concurrent readers never see a partial file
+        tmp = self._file(name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, self._file(name))
+
+    def _load_array(self, name: str) -> np.ndarray:
+        return np.load(self._file(name), mmap_mode="r")
+
+    def exists(self) -> bool:
+        return os.path.exists(self._file("meta.json"))
+
+    def content(self) -> Optional[str]:
+        """Digest of the texts the stored signatures were built from (None for older stores)."""
+        with open(self._file("meta.json")) as f:
+            return json.load(f).get("content")
+
+    def save(self, asins: Sequence[str], sig_matrix: np.ndarray, content: Optional[str] = None) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        # band buckets and packed copies derived from older signatures are stale now
+        for name in os.listdir(self.path):
+            if name.startswith(("bands_", "signatures_b")):
+                os.remove(self._file(name))
+        self._save_array("asins.npy", np.asarray(asins, dtype=str))
+        self._save_array("signatures.npy", np.ascontiguousarray(sig_matrix, dtype=np.int64))
+        meta = {"mode": self.mode, "K": self.K, "num_hashes": self.num_hashes, "seed": self.seed, "hasher": self.hasher,
+                "hash_version": HASH_VERSION, "n_items": int(len(asins)), "content": content}
+        with open(self._file("meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    def load(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Memory-mapped (asins, signature matrix)."""
+        return self._load_array("asins.npy"), self._load_array("signatures.npy")
+
+    def _band_name(self, b: int, r: int, part: str) -> str:
+        return f"bands_b{b}_r{r}_{part}.npy"
+
+    def has_bands(self, b: int, r: int) -> bool:
+        return os.path.exists(self._file(self._band_name(b, r, "order")))
+
+    def save_bands(self, b: int, r: int, keys_sorted: np.ndarray, order: np.ndarray) -> None:
+        self._save_array(self._band_name(b, r, "keys"), keys_sorted)
+        self._save_array(self._band_name(b, r, "order"), order)
+
+    def load_bands(self, b: int, r: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Memory-mapped (sorted keys, item order), each shape (b, n_items)."""
+        return self._load_array(self._band_name(b, r, "keys")), self._load_array(self._band_name(b, r, "order"))
+
+    def bands(self, b: int, r: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Load band buckets, building and saving them from the stored signatures if missing."""
+        if not self.has_bands(b, r):
+            _, sigs = self.load()
+            self.save_bands(b, r, *build_band_buckets(sigs, b, r))
+        return self.load_bands(b, r)
+
+    def packed(self, bits: int) -> PackedSignatures:
+        """b-bit packed signatures, packing and saving them from the full-width ones if missing."""
+        name = f"signatures_b{bits}.npy"
+        if not os.path.exists(self._file(name)):
+            _, sigs = self.load()
+            self._save_array(name, pack_bbit(sigs, bits))
+        return PackedSignatures(self._load_array(name), bits, self.num_hashes)
+
+
+def texts_digest(texts: Iterable[str]) -> str:
+    """Content stamp of the texts behind a signature matrix, in row order."""
+    h = hashlib.blake2b(digest_size=16)
+    for text in texts:
+        h.update(text.encode("utf-8", "surrogatepass"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def open_signatures(store: Optional[SignatureStore], asins: List[str], texts: Sequence[str], build) -> np.ndarray:
+    """Return the signature matrix for `asins`, reusing `store` when it was built from the same data.
+
+    The store is reused only if its id table matches `asins` and its content digest
+    matches `texts` (the texts being signed, aligned with asins), so products whose
+    text changed under an unchanged id are re-signed. `build()` must return the
+    (len(asins), num_hashes) matrix; it is saved to the store afterwards so the
+    next process can memory-map it.
+    """
+    content = texts_digest(texts) if store is not None else None
+    if store is not None and store.exists():
+        stored_asins, sigs = store.load()
+        if (len(stored_asins) == len(asins) and np.array_equal(stored_asins, np.asarray(asins, dtype=str))
+                and store.content() == content):
+            return sigs
+    sigs = build()
+    if store is not None:
+        store.save(asins, sigs, content)
+    return sigs
@@ -0,0 +1,269 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from bbit import PackedSignatures
+from shingling import degenerate_mask
+from minhash_lsh import HASHERS, MinHasher, ArrayLSH
+from metrics import batch_metrics, truth_csr
+from scoring import BlendedSignatures, score_candidates, sort_shingle_rows
+from signature_store import SignatureStore, open_signatures
+
+EVAL_CHUNK = 1024
+
+
+class SweepConfig(NamedTuple):
+    vary: str
+    mode: str
+    K: int
+    num_hashes: int
+    b: int
+    r: int
+
+
+def eval_truth(asins: Sequence[str], eval_rows: np.ndarray, truth_sets: Dict[str, Set[str]],
+               row_of: Optional[Dict[str, int]] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Truth of the eval queries as metrics.truth_csr; build it once per sweep and pass it as `truth`."""
+    if row_of is None:
+        row_of = {asin: i for i, asin in enumerate(asins)}
+    return truth_csr([truth_sets.get(asins[q], ()) for q in eval_rows], row_of)
+
+
+def evaluate_signatures(sig_matrix: np.ndarray, lsh: ArrayLSH, asins: Sequence[str], eval_rows: np.ndarray,
+                        truth_sets: Dict[str, Set[str]], top_k: int,
+                        shingles: Optional[Tuple[np.ndarray, np.ndarray]] = None, rerank_depth: int = 0,
+                        runner_up: Optional[np.ndarray] = None, probes: int = 0,
+                        stats: Optional[Dict[str, float]] = None, bits: int = 0,
+                        scorer: Optional[BlendedSignatures] = None,
+                        truth: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+                        n_bootstrap: int = 0) -> float:
+    """MAP@top_k of LSH candidates ranked by MinHash-Jaccard (optionally exact-Jaccard reranked).
+
+    `runner_up` (rows aligned with eval_rows) and `probes` enable multi-probe queries.
+    With `bits` > 0 candidates are scored from b-bit packed signatures; a `scorer`
+    (e.g. per-field BlendedSignatures) replaces sig_matrix for scoring altogether.
+    `truth` is eval_truth(...) precomputed (built from truth_sets otherwise).
+    If `stats` is given it receives the mean candidate count per query and the
+    precision/recall/nDCG@top_k of the same run (with `n_bootstrap` > 0, also
+    bootstrap confidence intervals of every metric).
+    """
+    if scorer is None:
+        scorer = PackedSignatures.from_signatures(sig_matrix, bits) if bits else sig_matrix
+    preds = np.full((len(eval_rows), top_k), -1, dtype=np.int64)
+    n_candidates = 0
+    # look up candidates a chunk of queries at a time: with few rows per band the
+    # candidate CSR of a whole large evaluation set would not fit in memory
+    for lo in range(0, len(eval_rows), EVAL_CHUNK):
+        rows = eval_rows[lo:lo + EVAL_CHUNK]
+        offsets, cand_ids = lsh.query_many(sig_matrix[rows], probes=probes,
+                                           runner_up=None if runner_up is None else runner_up[lo:lo + EVAL_CHUNK])
+        n_candidates += int(offsets[-1])
+        for i, q in enumerate(rows):
+            ids, _ = score_candidates(q, cand_ids[offsets[i]:offsets[i+1]], scorer, top_k,
+                                      shingles=shingles, rerank_depth=rerank_depth)
+            preds[lo + i, :len(ids)] = ids
+    if truth is None:
+        truth = eval_truth(asins, eval_rows, truth_sets)
+    truth_offsets, truth_ids, n_relevant = truth
+    metrics = batch_metrics(preds, truth_offsets, truth_ids, top_k, n_relevant=n_relevant, n_bootstrap=n_bootstrap)
+    if stats is not None:
+        stats["mean_candidates"] = n_candidates / len(eval_rows) if len(eval_rows) else 0.0
+        stats.update(metrics)
+    return metrics["map"]
+
+
+def plan_sweep(configs: Sequence[SweepConfig]) -> Dict[Tuple[str, int], List[SweepConfig]]:
+    """Group configurations by (mode, K): each group shares one shingling and one signing pass."""
+    groups: Dict[Tuple[str, int], List[SweepConfig]] = {}
+    for cfg in configs:
+        if cfg.b * cfg.r != cfg.num_hashes:
+            continue
+        groups.setdefault((cfg.mode, cfg.K), []).append(cfg)
+    return groups
+
+
+def run_group(asins: Sequence[str], texts: Sequence[str], K: int, configs: Sequence[SweepConfig],
+              truth_sets: Dict[str, Set[str]], eval_rows: np.ndarray, top_k: int,
+              store_dir: Optional[str] = None, rerank_depth: int = 0,
+              max_bucket: int = 0, min_shingles: int = 0, hasher: str = "classic",
+              bits: int = 0, truth: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+              stats: Optional[Dict[SweepConfig, Dict[str, float]]] = None, n_bootstrap: int = 0
+              ) -> List[Tuple[SweepConfig, float]]:
+    """Evaluate every config of one (mode, K) group.
+
+    Signatures are computed once at the largest num_hashes; smaller hash counts
+    use column prefixes (MinHasher draws its hash functions in a fixed order), and
+    only the banding is redone per (b, r). Hashers without that prefix property
+    (one-permutation hashing) sign once per distinct num_hashes instead.
+    Configs that are keys of `stats` get their dict filled with all metrics
+    (see evaluate_signatures, with `n_bootstrap` resamples).
+    """
+    mode = configs[0].mode
+    hasher_cls = HASHERS[hasher]
+    sign_at = [max(cfg.num_hashes for cfg in configs)] if hasher_cls.prefix_stable \
+        else sorted({cfg.num_hashes for cfg in configs})
+    hashed: List[Tuple[np.ndarray, np.ndarray]] = []
+
+    def shingle_csr() -> Tuple[np.ndarray, np.ndarray]:
+        # only hash the texts if some signatures are not in the store (or for reranking)
+        if not hashed:
+            hashed.append(MinHasher(1).hash_texts(texts, K))
+        return hashed[0]
+
+    def signatures(num_hashes: int) -> np.ndarray:
+        store = SignatureStore(store_dir, mode, K, num_hashes, hasher=hasher) if store_dir else None
+        return open_signatures(store, list(asins), texts,
+                               lambda: hasher_cls(num_hashes).signature_matrix(*shingle_csr()))
+
+    full = {H: signatures(H) for H in sign_at}
+    shingles = sort_shingle_rows(*shingle_csr()) if rerank_depth > 0 else None
+    degenerate = degenerate_mask(texts, K, min_shingles) if min_shingles > 0 else None
+    results = []
+    for cfg in configs:
+        H = min(h for h in sign_at if h >= cfg.num_hashes)
+        sig_matrix = full[H][:, :cfg.num_hashes]
+        if store_dir and H == cfg.num_hashes:
+            store = SignatureStore(store_dir, mode, K, H, hasher=hasher)
+            lsh = ArrayLSH.from_buckets(cfg.b, cfg.r, *store.bands(cfg.b, cfg.r), max_bucket=max_bucket)
+        else:
+            lsh = ArrayLSH(cfg.b, cfg.r, max_bucket=max_bucket).index(sig_matrix)
+        if degenerate is not None:
+            lsh.set_degenerate(sig_matrix, degenerate)
+        cfg_stats = stats.get(cfg) if stats is not None else None
+        score = evaluate_signatures(sig_matrix, lsh, asins, eval_rows, truth_sets, top_k,
+                                    shingles=shingles, rerank_depth=rerank_depth, bits=bits, truth=truth,
+                                    stats=cfg_stats, n_bootstrap=n_bootstrap if cfg_stats is not None else 0)
+        results.append((cfg, score))
+    return results
+
+
+def _run_group_with_stats(*args, stats: Dict[SweepConfig, Dict[str, float]], n_bootstrap: int
+                          ) -> Tuple[List[Tuple[SweepConfig, float]], Dict[SweepConfig, Dict[str, float]]]:
+    # pool workers cannot fill the caller's dicts, so the stats travel back with the scores
+    return run_group(*args, stats=stats, n_bootstrap=n_bootstrap), stats
+
+
+def run_sweep(asins: Sequence[str], texts_by_mode: Dict[str, Sequence[str]], configs: Sequence[SweepConfig],
+              truth_sets: Dict[str, Set[str]], eval_ids: Sequence[str], top_k: int,
+              store_dir: Optional[str] = None, n_jobs: int = 1, rerank_depth: int = 0,
+              max_bucket: int = 0, min_shingles: int = 0, hasher: str = "classic",
+              bits: int = 0, stats: Optional[Dict[SweepConfig, Dict[str, float]]] = None,
+              n_bootstrap: int = 0) -> List[Tuple[SweepConfig, float]]:
+    """Evaluate all configs, sharing shingles/signatures per (mode, K); groups run in a process pool.
+
+    Dicts in `stats`, keyed by config, are filled with that config's full metrics
+    and `n_bootstrap` confidence intervals from the same run as its MAP.
+    """
+    row_of = {asin: i for i, asin in enumerate(asins)}
+    eval_rows = np.array([row_of[q] for q in eval_ids], dtype=np.int64)
+    truth = eval_truth(asins, eval_rows, truth_sets, row_of)
+    # the same build may be listed under several sweeps; evaluate it once
+    unique = list(dict.fromkeys(cfg._replace(vary="") for cfg in configs))
+    wanted = {cfg._replace(vary="") for cfg in (stats or {})}
+    groups = plan_sweep(unique).items()
+    jobs = [(list(asins), texts_by_mode[mode], K, cfgs, truth_sets, eval_rows, top_k, store_dir, rerank_depth,
+             max_bucket, min_shingles, hasher, bits, truth)
+            for (mode, K), cfgs in groups]
+    group_stats = [{cfg: {} for cfg in cfgs if cfg in wanted} for _, cfgs in groups]
+    if n_jobs > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(jobs))) as pool:
+            futures = [pool.submit(_run_group_with_stats, *job, stats=st, n_bootstrap=n_bootstrap)
+                       for job, st in zip(jobs, group_stats)]
+            chunks = [f.result() for f in futures]
+    else:
+        chunks = [_run_group_with_stats(*job, stats=st, n_bootstrap=n_bootstrap)
+                  for job, st in zip(jobs, group_stats)]
+    scores = {cfg: score for chunk, _ in chunks for cfg, score in chunk}
+    if stats is not None:
+        found = {cfg: st for _, chunk_stats in chunks for cfg, st in chunk_stats.items()}
+        for cfg, out in stats.items():
+            out.update(found.get(cfg._replace(vary=""), {}))
+    return [(cfg, scores[cfg._replace(vary="")]) for cfg in configs if cfg._replace(vary="") in scores]
+
+
+def run_probe_sweep(asins: Sequence[str], texts: Sequence[str], K: int, num_hashes: int,
+                    band_rows: Sequence[Tuple[int, int]], probes_list: Sequence[int],
+                    truth_sets: Dict[str, Set[str]], eval_ids: Sequence[str], top_k: int,
+                    store_dir: Optional[str] = None, mode: str = "", hasher: str = "classic"
+                    ) -> List[Dict[str, float]]:
+    """MAP@top_k, mean candidate count and index size for each (b, r) x probe budget.
+
+    Lets a smaller index (fewer bands) with multi-probe queries be compared
+    against a larger one without probes.
+    """
+    row_of = {asin: i for i, asin in enumerate(asins)}
+    eval_rows = np.array([row_of[q] for q in eval_ids], dtype=np.int64)
+    truth = eval_truth(asins, eval_rows, truth_sets, row_of)
+    mh = HASHERS[hasher](num_hashes)
+    store = SignatureStore(store_dir, mode, K, num_hashes, hasher=hasher) if store_dir else None
+    sig_matrix = open_signatures(store, list(asins), texts,
+                                 lambda: mh.signature_matrix(*mh.hash_texts(texts, K)))
+    # runner-up hash values are only needed for the queries
+    runner_up = mh.runner_up_matrix(*mh.hash_texts((texts[q] for q in eval_rows), K))
+    rows = []
+    for b, r in band_rows:
+        sigs = sig_matrix[:, :b * r]
+        lsh = ArrayLSH(b, r).index(sigs)
+        for probes in probes_list:
+            stats: Dict[str, float] = {}
+            score = evaluate_signatures(sigs, lsh, asins, eval_rows, truth_sets, top_k,
+                                        runner_up=runner_up[:, :b * r], probes=probes, stats=stats, truth=truth)
+            rows.append({"K": K, "num_hashes": b * r, "b": b, "r": r, "probes": probes, "MAP@10": score,
+                         "mean_candidates": stats["mean_candidates"], "index_bytes": lsh.nbytes})
+    return rows
+
+
+def compare_hashers(asins: Sequence[str], texts: Sequence[str], K: int, num_hashes: int, b: int, r: int,
+                    truth_sets: Dict[str, Set[str]], eval_ids: Sequence[str], top_k: int) -> List[Dict[str, float]]:
+    """MAP@top_k and signature build time of every hasher in HASHERS on the same shingles."""
+    row_of = {asin: i for i, asin in enumerate(asins)}
+    eval_rows = np.array([row_of[q] for q in eval_ids], dtype=np.int64)
+    truth = eval_truth(asins, eval_rows, truth_sets, row_of)
+    values, offsets = MinHasher(1).hash_texts(texts, K)
+    rows = []
+    for name, hasher_cls in HASHERS.items():
+        mh = hasher_cls(num_hashes)
+        t = time.perf_counter()
+        sig_matrix = mh.signature_matrix(values, offsets)
+        build_s = time.perf_counter() - t
+        lsh = ArrayLSH(b, r).index(sig_matrix)
+        score = evaluate_signatures(sig_matrix, lsh, asins, eval_rows, truth_sets, top_k, truth=truth)
+        rows.append({"hasher": name, "K": K, "num_hashes": num_hashes, "b": b, "r": r,
+                     "MAP@10": score, "build_seconds": build_s})
+    return rows
+
+
+def compare_field_modes(asins: Sequence[str], titles: Sequence[str], descs: Sequence[str], pstd_texts: Sequence[str],
+                        K: int, num_hashes: int, b: int, r: int, truth_sets: Dict[str, Set[str]],
+                        eval_ids: Sequence[str], top_k: int, title_weight: float = 0.5) -> List[Dict[str, float]]:
+    """MAP@top_k of PSTD built from the concatenated text vs. from per-field signatures.
+
+    "text" signs the PSTD string itself; "field_union" takes the elementwise minimum of
+    the title and description signatures; "field_blend" uses the same candidates but
+    scores title_weight * J(title) + (1 - title_weight) * J(desc).
+    """
+    row_of = {asin: i for i, asin in enumerate(asins)}
+    eval_rows = np.array([row_of[q] for q in eval_ids], dtype=np.int64)
+    truth = eval_truth(asins, eval_rows, truth_sets, row_of)
+    mh = MinHasher(num_hashes)
+    t = time.perf_counter()
+    text_sigs = mh.signature_matrix(*mh.hash_texts(pstd_texts, K))
+    text_s = time.perf_counter() - t
+    t = time.perf_counter()
+    title_sigs = mh.signature_matrix(*mh.hash_texts(titles, K))
+    desc_sigs = mh.signature_matrix(*mh.hash_texts(descs, K))
+    union_sigs = np.minimum(title_sigs, desc_sigs)
+    field_s = time.perf_counter() - t
+    union_lsh = ArrayLSH(b, r).index(union_sigs)
+    blend = BlendedSignatures([title_sigs, desc_sigs], [title_weight, 1.0 - title_weight])
+    runs = [("text", text_sigs, ArrayLSH(b, r).index(text_sigs), None, text_s),
+            ("field_union", union_sigs, union_lsh, None, field_s),
+            ("field_blend", union_sigs, union_lsh, blend, field_s)]
+    rows = []
+    for name, sigs, lsh, scorer, build_s in runs:
+        score = evaluate_signatures(sigs, lsh, asins, eval_rows, truth_sets, top_k, scorer=scorer, truth=truth)
+        rows.append({"variant": name, "K": K, "num_hashes": num_hashes, "b": b, "r": r,
+                     "MAP@10": score, "build_seconds": build_s})
+    return rows
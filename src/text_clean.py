@@ -1,5 +1,7 @@
 import re
 import html
+
+import numpy as np
 from typing import Optional
 
 TAG_RE = re.compile(r"<[^>]+>")
@@ -21,3 +23,35 @@ def normalize_text(s: Optional[str]) -> str:
     s = re.sub(r"[^a-z0-9]+", " ", s)
     s = re.sub(r"\s+", " ", s).strip()
     return s
+
+def build_text(p: dict, mode: str) -> str:
+    """Text that is shingled for a product in mode PST (title), PSD (description) or PSTD."""
+    if mode == "PST":
+        return p['norm_title']
+    if mode == "PSD":
+        return p['norm_desc']
+    # PSTD hybrid
+    return (p['norm_title'] + " " + p['norm_title'] + " " + p['norm_desc']).strip()
+
+# byte -> normalized byte: a-z and 0-9 kept, A-Z lowered, everything else a space
+_BYTE_MAP = np.full(256, ord(" "), dtype=np.uint8)
+for _c in b"abcdefghijklmnopqrstuvwxyz0123456789":
+    _BYTE_MAP[_c] = _c
+for _c in b"ABCDEFGHIJKLMNOPQRSTUVWXYZ":
+    _BYTE_MAP[_c] = _c + 32
+
+def normalize_bytes(s: Optional[str]) -> bytes:
+    """normalize_text as ASCII bytes, done with a byte lookup table instead of regex passes."""
+    if not s:
+        return b""
+    text = strip_html(s) if "<" in s or "&" in s else s
+    if not text.isascii():
+        # str.lower() maps a few non-ASCII letters onto ASCII; keep the exact semantics.
+        # normalize_text strips the HTML itself, so give it the original input
+        # (stripping twice would unescape "&lt;b&gt;" and then drop it as a tag)
+        return normalize_text(s).encode("ascii")
+    b = _BYTE_MAP[np.frombuffer(text.encode("ascii"), dtype=np.uint8)]
+    space = b == ord(" ")
+    # drop a space that follows another space, then trim the ends
+    keep = ~(space & np.r_[True, space[:-1]])
+    return b[keep].tobytes().strip(b" ")
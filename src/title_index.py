@@ -0,0 +1,132 @@
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from text_clean import normalize_text
+
+
+def _trigram_codes(buf: np.ndarray) -> np.ndarray:
+    # 24-bit code of the 3 bytes starting at every position
+    b = buf.astype(np.int32)
+    return (b[:-2] << 16) | (b[1:-1] << 8) | b[2:]
+
+
+class TitleIndex:
+    """Character-trigram inverted index over normalized titles for substring search.
+
+    Every distinct trigram of a title maps to a sorted posting list of row ids
+    (`grams`, `offsets`, `postings` in CSR form). A query's posting lists are
+    intersected shortest-first by binary search into the longer lists, and the
+    survivors are checked against the title bytes (`text`, `text_offsets`, the
+    same layout as the product cache columns), so results are exact. Queries shorter than three characters scan the title
+    bytes directly, a block of titles at a time, and stop once the requested page is
+    filled. Titles are sliced from `text` per row or block, so a memory-mapped column
+    is never copied into memory as a whole.
+    """
+
+    SCAN_BLOCK = 1 << 20
+
+    def __init__(self, grams: np.ndarray, offsets: np.ndarray, postings: np.ndarray,
+                 text: np.ndarray, text_offsets: np.ndarray):
+        self.grams = grams
+        self.offsets = offsets
+        self.postings = postings
+        self.text = text
+        self.text_offsets = text_offsets
+
+    @classmethod
+    def build(cls, titles: Sequence[str]) -> "TitleIndex":
+        encoded = [t.encode("utf-8") for t in titles]
+        lengths = np.array([len(e) for e in encoded], dtype=np.int64)
+        text_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=text_offsets[1:])
+        text = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        # trigrams that start inside a title and end before it does
+        per_title = np.maximum(lengths - 2, 0)
+        rows = np.repeat(np.arange(len(encoded), dtype=np.int64), per_title)
+        pos = np.arange(int(per_title.sum()), dtype=np.int64) + np.repeat(
+            text_offsets[:-1] - (np.cumsum(per_title) - per_title), per_title)
+        codes = _trigram_codes(text)[pos] if len(text) >= 3 else np.zeros(0, dtype=np.int32)
+        n = max(len(encoded), 1)
+        # one (trigram, row) pair per occurrence; unique() sorts by trigram, then row
+        pairs = np.unique(codes.astype(np.int64) * n + rows)
+        gram_of, postings = pairs // n, (pairs % n).astype(np.int32)
+        grams, starts = np.unique(gram_of, return_index=True)
+        offsets = np.append(starts, len(postings)).astype(np.int64)
+        return cls(grams.astype(np.int32), offsets, postings, text, text_offsets)
+
+    def arrays(self) -> dict:
+        """Index arrays to persist (the title bytes are stored with the product columns)."""
+        return {"grams": self.grams, "offsets": self.offsets, "postings": self.postings}
+
+    def __len__(self) -> int:
+        return len(self.text_offsets) - 1
+
+    def _title(self, row: int) -> bytes:
+        return self.text[self.text_offsets[row]:self.text_offsets[row + 1]].tobytes()
+
+    def _candidates(self, q: bytes) -> np.ndarray:
+        codes = np.unique(_trigram_codes(np.frombuffer(q, dtype=np.uint8)))
+        lists: List[np.ndarray] = []
+        for code in codes:
+            i = np.searchsorted(self.grams, code)
+            if i == len(self.grams) or self.grams[i] != code:
+                return np.zeros(0, dtype=np.int32)
+            lists.append(self.postings[self.offsets[i]:self.offsets[i + 1]])
+        lists.sort(key=len)
+        cand = np.asarray(lists[0])
+        for plist in lists[1:]:
+            # binary-search the (short) survivors in the longer sorted list
+            idx = np.minimum(np.searchsorted(plist, cand), len(plist) - 1)
+            cand = cand[plist[idx] == cand]
+            if len(cand) == 0:
+                break
+        return cand
+
+    def _scan(self, q: bytes, need: int) -> List[int]:
+        rows: List[int] = []
+        n = len(self)
+        lo = 0
+        while lo < n and len(rows) < need:
+            # whole titles of about SCAN_BLOCK bytes, so no match is lost at a block edge
+            start = int(self.text_offsets[lo])
+            hi = int(np.searchsorted(self.text_offsets, start + self.SCAN_BLOCK, side="right")) - 1
+            hi = min(max(hi, lo + 1), n)
+            raw = self.text[start:int(self.text_offsets[hi])].tobytes()
+            bounds = self.text_offsets[lo:hi + 1] - start
+            pos = raw.find(q)
+            while pos >= 0 and len(rows) < need:
+                i = int(np.searchsorted(bounds, pos, side="right")) - 1
+                if pos + len(q) <= bounds[i + 1]:
+                    rows.append(lo + i)
+                    pos = raw.find(q, int(bounds[i + 1]))
+                else:
+                    # match spans two titles
+                    pos = raw.find(q, pos + 1)
+            lo = hi
+        return rows
+
+    def search(self, query: str, offset: int = 0, limit: int = 50) -> Tuple[np.ndarray, bool]:
+        """Row ids of titles containing `query` (normalized like norm_title), one page at a time.
+
+        Returns (rows[offset:offset+limit] in catalog order, whether more matches follow).
+        """
+        need = offset + limit + 1
+        q = normalize_text(query).encode("utf-8")
+        if not q:
+            rows = np.arange(offset, min(need, len(self)), dtype=np.int64)
+        elif len(q) < 3:
+            rows = np.array(self._scan(q, need), dtype=np.int64)[offset:]
+        else:
+            cand = self._candidates(q)
+            if len(q) == 3:
+                rows = cand[:need].astype(np.int64)[offset:]
+            else:
+                hits: List[int] = []
+                for row in cand.tolist():
+                    if q in self._title(row):
+                        hits.append(row)
+                        if len(hits) >= need:
+                            break
+                rows = np.array(hits[offset:], dtype=np.int64)
+        return rows[:limit], len(rows) > limit
@@ -0,0 +1,141 @@
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from minhash_lsh import MinHasher, ArrayLSH, band_keys
+from scoring import signature_scores
+
+
+def s_curve(s: np.ndarray, b: int, r: int) -> np.ndarray:
+    """Probability that a pair with Jaccard s shares at least one of b bands of r rows."""
+    return 1.0 - (1.0 - np.asarray(s, dtype=np.float64) ** r) ** b
+
+
+def sample_similarities(sig_matrix: np.ndarray, max_pairs: int = 200_000, seed: int = 0) -> np.ndarray:
+    """MinHash-Jaccard estimates for random distinct pairs of rows."""
+    n = sig_matrix.shape[0]
+    if n < 2:
+        return np.zeros(0)
+    rng = np.random.default_rng(seed)
+    m = min(max_pairs, n * (n - 1) // 2)
+    i = rng.integers(0, n, m)
+    j = rng.integers(0, n - 1, m)
+    j = j + (j >= i)  # never pair a row with itself
+    out = np.empty(m)
+    for lo in range(0, m, 10_000):
+        hi = min(lo + 10_000, m)
+        out[lo:hi] = (sig_matrix[i[lo:hi]] == sig_matrix[j[lo:hi]]).mean(axis=1)
+    return out
+
+
+def take_rows(values: np.ndarray, offsets: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sub-layout of the given rows of a CSR layout, in that order."""
+    counts = np.diff(offsets)[rows]
+    new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(counts, out=new_offsets[1:])
+    starts = np.repeat(offsets[rows] - new_offsets[:-1], counts)
+    return values[starts + np.arange(new_offsets[-1])], new_offsets
+
+
+def _calibrate(sig_matrix: np.ndarray, repeats: int = 3) -> Dict[str, float]:
+    # seconds per band lookup and per scored candidate-hash, measured on the sample
+    n, H = sig_matrix.shape
+    lsh = ArrayLSH(H, 1).index(sig_matrix)
+    q = sig_matrix[: min(64, n)]
+    t = time.perf_counter()
+    for _ in range(repeats):
+        lsh.query_many(q)
+    per_band = (time.perf_counter() - t) / (repeats * len(q) * H)
+    cands = np.arange(n)
+    t = time.perf_counter()
+    for _ in range(repeats):
+        signature_scores(sig_matrix[0], cands, sig_matrix)
+    per_cand_hash = (time.perf_counter() - t) / (repeats * n * H)
+    return {"per_band": per_band, "per_cand_hash": per_cand_hash}
+
+
+def tune(texts: Optional[Sequence[str]], K: int, threshold: float, recall_goal: float = 0.9,
+         hash_options: Sequence[int] = (20, 50, 100, 150, 200), sample_size: int = 2000,
+         n_catalog: Optional[int] = None, seed: int = 0,
+         shingles: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> List[Dict[str, float]]:
+    """Rank (num_hashes, b, r) settings by predicted cost subject to a recall goal.
+
+    On a random sample of `texts`, signatures at the largest hash count give the
+    pairwise similarity distribution. For every b*r = num_hashes the S-curve then
+    predicts recall at `threshold` (P(threshold), a lower bound for more similar
+    pairs), candidates per query (catalog size x mean collision probability over
+    sampled pairs, plus the share of the largest bucket seen in the sample), query
+    time (calibrated per-band and per-candidate costs) and index memory.
+
+    Rows are sorted best first: settings meeting the recall goal by predicted
+    query time, then the rest by recall.
+
+    Pass `shingles` (a CSR hash layout, e.g. SimilarityEngine.shingles) to sample
+    already hashed rows instead of hashing `texts`.
+    """
+    n = len(texts) if shingles is None else len(shingles[1]) - 1
+    n_catalog = n_catalog or n
+    rng = np.random.default_rng(seed)
+    pick = np.sort(rng.choice(n, size=min(sample_size, n), replace=False))
+    max_h = max(hash_options)
+    mh = MinHasher(max_h)
+    if shingles is None:
+        sample_sigs = mh.signature_matrix(*mh.hash_texts((texts[i] for i in pick), K))
+    else:
+        sample_sigs = mh.signature_matrix(*take_rows(*shingles, pick))
+    sims = sample_similarities(sample_sigs, seed=seed)
+    cost = _calibrate(sample_sigs)
+
+    rows = []
+    for H in sorted(set(hash_options)):
+        for r in range(1, H + 1):
+            if H % r:
+                continue
+            b = H // r
+            sigs = sample_sigs[:, :H]
+            # bucket occupancy: largest share of the sample that falls in one bucket of any band
+            keys = band_keys(sigs, b, r)
+            hot = max(np.unique(keys[:, band], return_counts=True)[1].max() for band in range(b)) / len(pick)
+            cand_frac = float(s_curve(sims, b, r).mean()) if len(sims) else 0.0
+            cands = n_catalog * max(cand_frac, hot)
+            rows.append({
+                "num_hashes": H, "b": b, "r": r,
+                "threshold": threshold,
+                "recall_at_threshold": float(s_curve(threshold, b, r)),
+                "pred_candidates": cands,
+                "pred_query_ms": 1e3 * (b * cost["per_band"] + cands * H * cost["per_cand_hash"]),
+                "pred_index_mb": n_catalog * (b * 12 + H * 8) / 2**20,
+                "hot_bucket_share": float(hot),
+            })
+    ok = [row for row in rows if row["recall_at_threshold"] >= recall_goal]
+    rest = [row for row in rows if row["recall_at_threshold"] < recall_goal]
+    ok.sort(key=lambda row: (row["pred_query_ms"], row["pred_index_mb"]))
+    rest.sort(key=lambda row: -row["recall_at_threshold"])
+    return ok + rest
+
+
+def validate(texts: Sequence[str], K: int, num_hashes: int, b: int, r: int, threshold: float,
+             sample_size: int = 2000, reference_hashes: int = 200, seed: int = 1) -> Dict[str, float]:
+    """Measure recall of pairs above `threshold` and candidates per query on a fresh sample.
+
+    Reference similarities come from `reference_hashes`-wide signatures.
+    """
+    rng = np.random.default_rng(seed)
+    pick = np.sort(rng.choice(len(texts), size=min(sample_size, len(texts)), replace=False))
+    mh = MinHasher(max(num_hashes, reference_hashes))
+    sigs = mh.signature_matrix(*mh.hash_texts((texts[i] for i in pick), K))
+    offsets, ids = ArrayLSH(b, r).index(sigs[:, :num_hashes]).query_many(sigs[:, :num_hashes])
+    found = 0
+    total = 0
+    for q in range(len(pick)):
+        sims = signature_scores(sigs[q], np.arange(q + 1, len(pick)), sigs)
+        truth = np.flatnonzero(sims >= threshold) + q + 1
+        total += len(truth)
+        found += len(np.intersect1d(truth, ids[offsets[q]:offsets[q+1]], assume_unique=True))
+    return {
+        "sample_size": int(len(pick)),
+        "pairs_above_threshold": int(total),
+        "measured_recall": found / total if total else float("nan"),
+        "measured_candidate_frac": float(np.diff(offsets).mean() / len(pick)),
+    }
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules under src/ import each other by top-level name
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+import bbit
+from bbit import BIT_WIDTHS, PackedSignatures, bbit_matches, bbit_similarity, pack_bbit
+
+
+@pytest.mark.parametrize("bits", BIT_WIDTHS)
+@pytest.mark.parametrize("num_hashes", [1, 20, 64, 100])
+def test_bbit_matches_count_equal_low_bits(bits, num_hashes):
+    rng = np.random.default_rng(bits * 1000 + num_hashes)
+    sigs = rng.integers(0, 2**31 - 1, size=(50, num_hashes), dtype=np.int64)
+    # make some rows share many entries with row 0
+    sigs[1:10, : num_hashes // 2] = sigs[0, : num_hashes // 2]
+    words = pack_bbit(sigs, bits)
+    assert words.shape == (50, -(-num_hashes * bits // 64))
+    low = sigs & ((1 << bits) - 1)
+    expected = (low == low[0]).sum(axis=1)
+    np.testing.assert_array_equal(bbit_matches(words[0], words, bits, num_hashes), expected)
+    np.testing.assert_allclose(PackedSignatures(words, bits, num_hashes).scores(words[0], np.arange(50)),
+                               bbit_similarity(expected, bits, num_hashes))
+
+
+def test_byte_table_popcount_matches_bitwise_count(monkeypatch):
+    words = np.random.default_rng(0).integers(0, 2**63, size=100, dtype=np.int64).astype(np.uint64)
+    expected = np.array([bin(int(w)).count("1") for w in words])
+    np.testing.assert_array_equal(bbit._popcount(words), expected)
+    monkeypatch.delattr(np, "bitwise_count", raising=False)
+    np.testing.assert_array_equal(bbit._popcount(words), expected)
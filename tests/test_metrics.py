@@ -0,0 +1,48 @@
+import random
+
+import numpy as np
+
+from metrics import batch_metrics, map_at_k, precision_at_k, truth_csr
+
+
+def _random_case(seed, n_items=60, n_queries=40, k=10):
+    rng = random.Random(seed)
+    items = [f"B{i:04d}" for i in range(n_items)]
+    preds = {}
+    truth = {}
+    for q in range(n_queries):
+        preds[f"Q{q}"] = rng.sample(items, rng.randint(0, k))
+        # some truth ids are not in the catalog: they count as relevant but cannot be predicted
+        truth[f"Q{q}"] = set(rng.sample(items, rng.randint(0, 6)))
+        if rng.random() < 0.3:
+            truth[f"Q{q}"].add(f"X{q}")
+    return items, preds, truth
+
+
+def _as_arrays(items, preds, truth, k):
+    row_of = {asin: i for i, asin in enumerate(items)}
+    pred = np.full((len(preds), k), -1, dtype=np.int64)
+    for i, p in enumerate(preds.values()):
+        pred[i, :len(p)] = [row_of[a] for a in p]
+    return pred, truth_csr([truth[q] for q in preds], row_of)
+
+
+def test_batch_metrics_matches_list_metrics():
+    for seed in range(5):
+        items, preds, truth = _random_case(seed)
+        for k in (1, 5, 10):
+            pred, (offsets, ids, sizes) = _as_arrays(items, preds, truth, 10)
+            got = batch_metrics(pred, offsets, ids, k, n_relevant=sizes)
+            assert np.isclose(got["map"], map_at_k(preds, truth, k))
+            assert np.isclose(got["precision"], np.mean([precision_at_k(preds[q], truth[q], k) for q in preds]))
+            recall = [len(set(preds[q][:k]) & truth[q]) / len(truth[q]) if truth[q] else 0.0 for q in preds]
+            assert np.isclose(got["recall"], np.mean(recall))
+
+
+def test_bootstrap_interval_brackets_the_mean():
+    items, preds, truth = _random_case(7, n_queries=200)
+    pred, (offsets, ids, sizes) = _as_arrays(items, preds, truth, 10)
+    got = batch_metrics(pred, offsets, ids, 10, n_relevant=sizes, n_bootstrap=300)
+    for name in ("precision", "map", "recall", "ndcg"):
+        assert got[f"{name}_ci_low"] <= got[name] <= got[f"{name}_ci_high"]
+    assert got == batch_metrics(pred, offsets, ids, 10, n_relevant=sizes, n_bootstrap=300)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from minhash_lsh import LSH, ArrayLSH, MinHasher, OnePermMinHasher
+from shingling import char_k_shingles
+
+TEXTS = ["", "ab", "water filter", "water filter for refrigerator", "café crème",
+         "dryer vent hose 4 inch", "dryer vent hose 4 inch kit"] + [f"replacement part {i} fits model w{i * 7}" for i in range(40)]
+
+
+@pytest.mark.parametrize("hasher_cls", [MinHasher, OnePermMinHasher])
+@pytest.mark.parametrize("chunk_size", [1 << 20, 64])
+def test_signature_matrix_matches_per_text_signature(hasher_cls, chunk_size):
+    mh = hasher_cls(32)
+    values, offsets = mh.hash_texts(TEXTS, 3)
+    sigs = mh.signature_matrix(values, offsets, chunk_size=chunk_size)
+    for i, text in enumerate(TEXTS):
+        np.testing.assert_array_equal(sigs[i], mh.signature(char_k_shingles(text, 3)))
+
+
+def test_signature_matrix_parallel_matches_serial():
+    mh = MinHasher(16)
+    values, offsets = mh.hash_texts(TEXTS, 3)
+    np.testing.assert_array_equal(mh.signature_matrix(values, offsets, chunk_size=64, n_jobs=2),
+                                  mh.signature_matrix(values, offsets))
+
+
+@pytest.mark.parametrize("bands, rows", [(8, 2), (4, 4), (16, 1)])
+def test_array_lsh_candidates_match_dict_lsh(bands, rows):
+    mh = MinHasher(bands * rows)
+    sigs = mh.signature_matrix(*mh.hash_texts(TEXTS, 3))
+    asins = [f"B{i:03d}" for i in range(len(TEXTS))]
+    lsh = LSH(bands, rows)
+    buckets = lsh.index(dict(zip(asins, sigs)))
+    array_lsh = ArrayLSH(bands, rows).index(sigs)
+    offsets, ids = array_lsh.query_many(sigs)
+    for i in range(len(TEXTS)):
+        expected = lsh.query_candidates(sigs[i], buckets)
+        assert {asins[j] for j in array_lsh.query_candidates(sigs[i]).tolist()} == expected
+        assert {asins[j] for j in ids[offsets[i]:offsets[i + 1]].tolist()} == expected
+
+
+def test_smaller_minhasher_is_column_prefix():
+    values, offsets = MinHasher(1).hash_texts(TEXTS, 3)
+    np.testing.assert_array_equal(MinHasher(40).signature_matrix(values, offsets)[:, :10],
+                                  MinHasher(10).signature_matrix(values, offsets))
+
+
+def test_probes_extend_the_capped_candidate_bound():
+    # four hot buckets of 10: the query's own two (one per band) and the two its runner-ups probe
+    rows = [(0, 100 + i) for i in range(10)] + [(1, 200 + i) for i in range(10)] \
+        + [(300 + i, 0) for i in range(10)] + [(400 + i, 1) for i in range(10)]
+    sigs = np.array(rows, dtype=np.int64)
+    lsh = ArrayLSH(2, 1, max_bucket=5).index(sigs)
+    query, runner_up = np.array([[0, 0]]), np.array([[1, 1]])
+    for probes in (0, 2):
+        offsets, _ = lsh.query_many(query, probes=probes, runner_up=runner_up)
+        assert offsets[-1] == lsh.max_candidates(probes) == (2 + probes) * 5
+
+
+def test_one_perm_runner_up_is_second_smallest_offset_in_bin():
+    mh = OnePermMinHasher(16)
+    values, offsets = mh.hash_texts(TEXTS, 3)
+    runner_up = mh.runner_up_matrix(values, offsets)
+    a, b = int(mh.a[0]), int(mh.b[0])
+    for i in range(len(TEXTS)):
+        h = (a * values[offsets[i]:offsets[i + 1]] % mh.p + b) % mh.p
+        for j in range(16):
+            in_bin = np.unique(h[h // mh.bin_width == j] % mh.bin_width)
+            if len(in_bin):
+                assert runner_up[i, j] == (in_bin[1] if len(in_bin) > 1 else -1)
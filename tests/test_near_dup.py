@@ -0,0 +1,93 @@
+import csv
+import itertools
+import random
+
+import numpy as np
+
+from minhash_lsh import MinHasher, band_keys
+from near_dup import UnionFind, find_near_duplicates
+from shingling import degenerate_mask
+from signature_store import SignatureStore
+
+WORDS = "replacement water filter fits refrigerator models genuine oem part white black kit pack".split()
+
+
+def _components(n, pairs):
+    # reference clustering: depth-first search over the pair graph
+    adj = {i: set() for i in range(n)}
+    for a, b in pairs:
+        adj[a].add(b)
+        adj[b].add(a)
+    seen, out = set(), set()
+    for start in range(n):
+        if start in seen or not adj[start]:
+            continue
+        stack, comp = [start], set()
+        while stack:
+            x = stack.pop()
+            if x not in comp:
+                comp.add(x)
+                stack.extend(adj[x] - comp)
+        seen |= comp
+        out.add(frozenset(comp))
+    return out
+
+
+def test_union_find_matches_connected_components():
+    rng = random.Random(0)
+    pairs = [(rng.randrange(50), rng.randrange(50)) for _ in range(40)]
+    uf = UnionFind(50)
+    for a, b in pairs:
+        uf.union(a, b)
+    groups = {}
+    for x in range(50):
+        groups.setdefault(uf.find(x), set()).add(x)
+    assert {frozenset(g) for g in groups.values() if len(g) > 1} == _components(50, [p for p in pairs if p[0] != p[1]])
+
+
+def test_find_near_duplicates_matches_brute_force(tmp_path):
+    rng = random.Random(1)
+    texts = []
+    for i in range(120):
+        if texts and rng.random() < 0.4:
+            words = rng.choice(texts).split()
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+            texts.append(" ".join(words))
+        else:
+            texts.append(" ".join(rng.choices(WORDS, k=8)))
+    asins = [f"B{i:04d}" for i in range(len(texts))]
+    mh = MinHasher(20)
+    sigs = mh.signature_matrix(*mh.hash_texts(texts, 4))
+    store = SignatureStore(str(tmp_path / "store"), "PSTD", 4, 20)
+    store.save(asins, sigs)
+    b, r, threshold = 10, 2, 0.5
+    n_pairs, n_clusters = find_near_duplicates(asins, store, b, r, threshold, str(tmp_path), n_partitions=3)
+
+    keys = band_keys(sigs, b, r)
+    expected = {(i, j) for i, j in itertools.combinations(range(len(asins)), 2)
+                if (keys[i] == keys[j]).any() and (sigs[i] == sigs[j]).mean() >= threshold}
+    with open(tmp_path / "pairs.csv") as f:
+        got = {(asins.index(row["asin_a"]), asins.index(row["asin_b"])) for row in csv.DictReader(f)}
+    assert got == expected and n_pairs == len(expected)
+
+    with open(tmp_path / "clusters.csv") as f:
+        clusters = {}
+        for row in csv.DictReader(f):
+            clusters.setdefault(row["cluster"], set()).add(asins.index(row["asin"]))
+    assert {frozenset(c) for c in clusters.values()} == _components(len(asins), expected)
+    assert n_clusters == len(clusters)
+
+
+def test_degenerate_texts_stay_out_of_the_join(tmp_path):
+    texts = [""] * 30 + ["water filter fits refrigerator", "water filter fits refrigerators", "dryer vent hose kit"]
+    asins = [f"B{i:04d}" for i in range(len(texts))]
+    mh = MinHasher(20)
+    sigs = mh.signature_matrix(*mh.hash_texts(texts, 4))
+    store = SignatureStore(str(tmp_path / "store"), "PSD", 4, 20)
+    store.save(asins, sigs)
+    degenerate = degenerate_mask(texts, 4)
+    n_pairs, n_clusters = find_near_duplicates(asins, store, 10, 2, 0.5, str(tmp_path), n_partitions=2,
+                                               degenerate=degenerate)
+    assert (n_pairs, n_clusters) == (1, 1)
+    with open(tmp_path / "degenerate.csv") as f:
+        assert [row["asin"] for row in csv.DictReader(f)] == asins[:30]
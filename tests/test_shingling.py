@@ -0,0 +1,41 @@
+import pytest
+
+import numpy as np
+
+from shingling import batch_shingle_hashes, char_k_shingle_hashes, char_k_shingles, hash_bytes, normalize_and_shingle
+from text_clean import normalize_bytes, normalize_text
+
+TEXTS = ["", "a", "ab", "water filter", "water filter water filter", "café crème", "x y z 123",
+         "refrigerator door gasket replacement kit"]
+
+
+@pytest.mark.parametrize("k", [1, 2, 3, 5, 9])
+def test_batch_shingle_hashes_matches_string_shingles(k):
+    values, offsets = batch_shingle_hashes(TEXTS, k)
+    assert len(offsets) == len(TEXTS) + 1
+    for i, text in enumerate(TEXTS):
+        row = values[offsets[i]:offsets[i + 1]].tolist()
+        assert len(row) == len(set(row))
+        assert set(row) == {hash_bytes(s.encode("utf-8")) for s in char_k_shingles(text, k)}
+
+
+@pytest.mark.parametrize("chunk_bytes", [1, 10, 40])
+def test_batch_shingle_hashes_is_independent_of_chunking(chunk_bytes):
+    values, offsets = batch_shingle_hashes(TEXTS * 3, 3)
+    chunked_values, chunked_offsets = batch_shingle_hashes(TEXTS * 3, 3, chunk_bytes=chunk_bytes)
+    np.testing.assert_array_equal(chunked_offsets, offsets)
+    np.testing.assert_array_equal(chunked_values, values)
+
+
+RAW = ["", "Water Filter", "<p>Fits <b>GE</b> models</p>", "&lt;b&gt;café", "&lt;b&gt;Fits&lt;/b&gt; 40°F freezers",
+       "Crème brûlée &amp; co", "&eacute;tag&egrave;re", "DRYER--vent   HOSE", "İstanbul ICE maker", "&", "<>"]
+
+
+@pytest.mark.parametrize("raw", RAW)
+def test_normalize_bytes_matches_normalize_text(raw):
+    assert normalize_bytes(raw) == normalize_text(raw).encode("ascii")
+
+
+@pytest.mark.parametrize("raw", RAW)
+def test_normalize_and_shingle_matches_two_step_path(raw):
+    np.testing.assert_array_equal(normalize_and_shingle(raw, 4), char_k_shingle_hashes(normalize_text(raw), 4))
@@ -0,0 +1,23 @@
+import numpy as np
+
+from signature_store import SignatureStore, open_signatures
+
+
+def test_open_signatures_reuses_store_only_for_the_same_texts(tmp_path):
+    store = SignatureStore(str(tmp_path), "PST", 5, 2)
+    asins, texts = ["a", "b", "c"], ["water filter", "ice maker", "door gasket"]
+    builds = []
+
+    def build():
+        builds.append(1)
+        return np.arange(6, dtype=np.int64).reshape(3, 2) + len(builds)
+
+    first = np.array(open_signatures(store, asins, texts, build))
+    np.testing.assert_array_equal(open_signatures(store, asins, texts, build), first)
+    assert len(builds) == 1
+    # same ids, edited text: the stored signatures are stale
+    rebuilt = open_signatures(store, asins, ["water filter", "ice maker", "door seal"], build)
+    assert len(builds) == 2 and not np.array_equal(rebuilt, first)
+    # different ids
+    open_signatures(store, ["a", "b", "d"], ["water filter", "ice maker", "door seal"], build)
+    assert len(builds) == 3
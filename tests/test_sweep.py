@@ -0,0 +1,33 @@
+import random
+
+import pytest
+
+from sweep import SweepConfig, run_sweep
+
+WORDS = "water filter ice maker dryer vent hose door gasket ge whirlpool kit".split()
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    rng = random.Random(5)
+    asins = [f"A{i:03d}" for i in range(120)]
+    texts = [" ".join(rng.choices(WORDS, k=rng.randint(1, 6))) for _ in asins]
+    truth_sets = {a: set(rng.sample(asins, 5)) for a in asins[:40]}
+    return asins, texts, truth_sets
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+@pytest.mark.parametrize("options", [{}, {"bits": 4, "max_bucket": 8, "min_shingles": 3}, {"hasher": "oph"}])
+def test_stats_come_from_the_same_run_as_the_sweep_score(catalog, n_jobs, options):
+    asins, texts, truth_sets = catalog
+    configs = [SweepConfig("K", "PSTD", 3, 20, 10, 2), SweepConfig("K", "PSTD", 5, 20, 10, 2),
+               SweepConfig("hashes", "PSTD", 3, 10, 5, 2)]
+    fixed = configs[1]
+    stats = {fixed: {}}
+    results = run_sweep(asins, {"PSTD": texts}, configs, truth_sets, list(truth_sets), 10, n_jobs=n_jobs,
+                        stats=stats, n_bootstrap=50, **options)
+    assert dict(results)[fixed] == stats[fixed]["map"]
+    assert stats[fixed]["map_ci_low"] <= stats[fixed]["map"] <= stats[fixed]["map_ci_high"]
+    assert "mean_candidates" in stats[fixed]
+    # asking for stats does not change any score
+    assert run_sweep(asins, {"PSTD": texts}, configs, truth_sets, list(truth_sets), 10, **options) == results
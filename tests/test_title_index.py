@@ -0,0 +1,31 @@
+import random
+
+import pytest
+
+from text_clean import normalize_text
+from title_index import TitleIndex
+
+WORDS = "water filter ice maker dryer vent hose door gasket ge whirlpool kit w10295370a".split()
+
+
+@pytest.fixture(scope="module")
+def titles():
+    rng = random.Random(3)
+    return [normalize_text(" ".join(rng.choices(WORDS, k=rng.randint(0, 6)))) for _ in range(500)]
+
+
+@pytest.mark.parametrize("query", ["", "a", "er", "ice", "water filter", "  Water-FILTER ", "zzz", "w102", "t w"])
+@pytest.mark.parametrize("limit", [7, 1000])
+def test_search_matches_substring_scan(titles, query, limit, monkeypatch):
+    monkeypatch.setattr(TitleIndex, "SCAN_BLOCK", 64)
+    index = TitleIndex.build(titles)
+    q = normalize_text(query)
+    expected = [i for i, t in enumerate(titles) if q in t]
+    got, offset = [], 0
+    while True:
+        rows, more = index.search(query, offset, limit)
+        got += rows.tolist()
+        offset += limit
+        if not more:
+            break
+    assert got == expected